@@ -18,7 +18,8 @@ CREATE_COOLDOWN     = 1
 DB_PATH = Path("/data/bluetracker.db")
 
 # Crawler settings
-REQ_PAUSE = 2.5          # seconds between history requests
+REQ_PAUSE = 2.5          # seconds between history requests (across all crawl tasks)
+CRAWL_CONCURRENCY = 6    # parent channels crawled at once
 PAGE_SIZE = 50
 CUTOFF_DAYS = 365 * 10   # how far back to go
 CRAWL_VERBOSITY = 10     # print progress every N saves
@@ -27,15 +28,15 @@ CRAWL_VERBOSITY = 10     # print progress every N saves
 API_PAUSE = 2.1          # per-message pause for webhook rate-limit
 
 # Roles to track for live reposting
-TRACKED = {
+TRACKED = frozenset({
     587394944897908736,  # Server Admin
     680574750208294924,  # Product Manager
     226053427690471425,  # Senior GameMaster
     226053100790743044,  # GameMaster
-}
+})
 
 # UserIDs to track archived posts or retired gms that no longer have roles
-SEED_BLUE_IDS = {
+SEED_BLUE_IDS = frozenset({
     308821099863605249,  # Wyrom
     111937766157291520,  # Estild
     316371182146420746,  # Isten
@@ -87,14 +88,18 @@ SEED_BLUE_IDS = {
     1195131331047346246, # Apraxis
     190295595125047296,  # Tamuz  (late addition)
     306995432981266433,  # Modrian
-}
+})
 
 # channels to ignore from the source guild
-IGNORED_CHANNELS = {
+IGNORED_CHANNELS = frozenset({
     613879283038814228,  # Off-Topic
     1333880748461260921, # Platinum off-topic thread
     1171221232402845767, # Games and Trivia
-}
+})
+
+# discord.py hands us int IDs – a str here would silently never match
+assert all(isinstance(x, int) for x in TRACKED), "TRACKED must hold int role IDs"
+assert all(isinstance(x, int) for x in IGNORED_CHANNELS), "IGNORED_CHANNELS must hold int channel IDs"
 
 GM_NAME_OVERRIDES = {
     84034005221019648: "Naijin",           # spiffyjr
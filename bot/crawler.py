@@ -1,33 +1,50 @@
-import asyncio, time
+import asyncio, time, json, discord
 from datetime import datetime, timedelta, timezone
 from discord import TextChannel, ForumChannel
-from .db import fetchone, execute_with_retry
-from .repost import should_repost, cleanup_caches
-from .config import REQ_PAUSE, PAGE_SIZE, CUTOFF_DAYS, CRAWL_VERBOSITY, IGNORED_CHANNELS, FULL_BACKFILL_RUN
+from .db import read_fetchall, execute_with_retry, snowflake_to_ms
+from .repost import should_repost, cleanup_caches, unquoted_reply_id
+from .config import REQ_PAUSE, CRAWL_CONCURRENCY, PAGE_SIZE, CUTOFF_DAYS, CRAWL_VERBOSITY, IGNORED_CHANNELS, FULL_BACKFILL_RUN
 
 save_counter = 0
 inaccessible_channels = set()  # Cache of channel IDs we can't access
 finished_channels = set()
+_next_request_at = 0.0   # monotonic time the next history request may start
+_pace_lock = asyncio.Lock()
+ARCHIVED_THREAD_TTL = 3600   # seconds; archived threads rarely change
+_archived_threads = {}       # parent_id -> (fetched_at, threads oldest-first)
+last_seen_ids = None  # chan_id -> last seen message ID, loaded on first use
 
-# New table to track crawl progress
-CREATE_PROGRESS_TABLE = """
-CREATE TABLE IF NOT EXISTS crawl_progress (
-    chan_id TEXT PRIMARY KEY,
-    last_seen_id INTEGER NOT NULL,
-    updated_at INTEGER NOT NULL
-);
-"""
+async def load_last_seen_ids(db):
+    """Read every channel's progress in two queries instead of one per crawl"""
+    global last_seen_ids
+    ids = {}
+    # posts table first, for backward compatibility; crawl_progress wins
+    for chan_id, last_id in await read_fetchall(db, "SELECT chan_id, MAX(id) FROM posts GROUP BY chan_id"):
+        if last_id:
+            ids[int(chan_id)] = int(last_id)
+    for chan_id, last_id in await read_fetchall(db, "SELECT chan_id, last_seen_id FROM crawl_progress"):
+        if last_id:
+            ids[int(chan_id)] = int(last_id)
+    last_seen_ids = ids
+
+async def pace_request():
+    """
+    Wait for this request's slot. Crawl tasks run concurrently, but request
+    starts stay REQ_PAUSE apart globally, so the overall rate is unchanged.
+    """
+    global _next_request_at
+    async with _pace_lock:
+        now = time.monotonic()
+        wait = _next_request_at - now
+        _next_request_at = max(now, _next_request_at) + REQ_PAUSE
+    if wait > 0:
+        await asyncio.sleep(wait)
 
 async def get_last_seen_id(db, chan_id):
     """Get the last message ID we've seen in this channel"""
-    # First check progress table
-    row = await fetchone(db, "SELECT last_seen_id FROM crawl_progress WHERE chan_id = ?", (chan_id,))
-    if row and row[0]:
-        return int(row[0])
-    
-    # Fall back to posts table for backward compatibility
-    row = await fetchone(db, "SELECT MAX(id) FROM posts WHERE chan_id = ?", (chan_id,))
-    return int(row[0]) if row and row[0] else None
+    if last_seen_ids is None:
+        await load_last_seen_ids(db)
+    return last_seen_ids.get(int(chan_id))
 
 async def update_last_seen_id(db, chan_id, message_id):
     """Update the last message ID we've seen in this channel"""
@@ -37,6 +54,8 @@ async def update_last_seen_id(db, chan_id, message_id):
         "INSERT OR REPLACE INTO crawl_progress (chan_id, last_seen_id, updated_at) VALUES (?, ?, ?)",
         (chan_id, message_id, timestamp)
     )
+    if last_seen_ids is not None:
+        last_seen_ids[int(chan_id)] = int(message_id)
 
 async def save_channel(db, chan_id, name, accessible=True, parent_id=None):
     """
@@ -85,6 +104,16 @@ async def crawl_one(ch, cutoff, me, db, build_snippet, blue_ids, db_add_author,
 
     # Get the last message ID we've seen (not just saved)
     earliest_seen = await get_last_seen_id(db, ch.id)   # None first time
+
+    # Snowflakes carry their timestamp: if the channel's newest message, or
+    # the point we'd resume from, is already past the cutoff, there is
+    # nothing left to pull – settle it without a history request
+    newest = getattr(ch, 'last_message_id', None)
+    if ((newest and discord.utils.snowflake_time(newest) < cutoff) or
+            (earliest_seen and discord.utils.snowflake_time(earliest_seen) < cutoff)):
+        finished_channels.add(ch.id)
+        return
+
     before_obj   = discord.Object(id=earliest_seen) if earliest_seen else None
     
     pulled = 0
@@ -98,23 +127,38 @@ async def crawl_one(ch, cutoff, me, db, build_snippet, blue_ids, db_add_author,
                 limit=PAGE_SIZE,
                 before=before_obj,           # newest→oldest page
                 oldest_first=False)]
+        await pace_request()
         messages = await asyncio.wait_for(_get_messages(), timeout=15.0)
 
         if not messages:
             finished_channels.add(ch.id)
             return  # we reached the very beginning of the channel
 
+        if len(messages) < PAGE_SIZE:
+            # a short page already reached the beginning – don't spend a
+            # request next sweep just to get an empty one back
+            finished_channels.add(ch.id)
+
         messages.reverse()                 # now oldest→newest for your loop
         new_earliest = messages[0].id      # the lowest ID in this page
         
+        # one lookup for the whole page instead of one per message
+        # (a row committed meanwhile by on_message is absorbed by OR IGNORE)
+        rows = await read_fetchall(
+            db,
+            "SELECT id FROM posts WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps([m.id for m in messages]),)
+        )
+        existing = {row[0] for row in rows}
+
+        rows_to_insert = []
         for m in messages:
             if m.created_at < cutoff:
                 finished_channels.add(ch.id)
                 break
             pulled += 1
 
-            existing = await fetchone(db, "SELECT id FROM posts WHERE id = ?", (m.id,))
-            if existing:
+            if m.id in existing:
                 continue
                 
             new_messages_found += 1            
@@ -122,25 +166,29 @@ async def crawl_one(ch, cutoff, me, db, build_snippet, blue_ids, db_add_author,
             if should_repost(m, blue_ids):
                 blue_ids.add(m.author.id)
                 await db_add_author(m.author)
-                snippet = await build_snippet(m)
-                
-                # Use INSERT OR REPLACE to handle any updates to existing messages
-                await execute_with_retry(
-                    db,
-                    "INSERT OR REPLACE INTO posts VALUES (?,?,?,?,?,?)",
-                    (m.id, m.channel.id, m.author.id,
-                     int(m.created_at.timestamp()*1000), snippet, 0)
-                )
-                
-                save_counter += 1
-                saved_this_run += 1
-                
-                await db.commit()
+                # no parent fetch here: replay quotes it from our own posts
+                snippet = await build_snippet(m, fetch_parent=False)
+                rows_to_insert.append((m.id, m.channel.id, m.author.id,
+                                       snowflake_to_ms(m.id), snippet, 0,
+                                       unquoted_reply_id(m)))
+        
+        # the page's posts and the progress marker land in a single commit
+        if rows_to_insert:
+            await execute_with_retry(
+                db,
+                "INSERT OR IGNORE INTO posts "
+                "(id, chan_id, author_id, ts, content, replayed, reply_to_id) "
+                "VALUES (?,?,?,?,?,?,?)",
+                rows_to_insert,
+                many=True
+            )
+            save_counter += len(rows_to_insert)
+            saved_this_run = len(rows_to_insert)
         
         # update progress tracker with the *new* earliest ID
         if new_earliest and new_earliest != earliest_seen:
             await update_last_seen_id(db, ch.id, new_earliest)
-            await db.commit()
+        await db.commit()
         
         # Show progress for this channel/thread
         ch_type = "thread" if isinstance(ch, discord.Thread) else "channel"
@@ -173,12 +221,12 @@ async def iter_all_threads(parent: discord.abc.GuildChannel):
     # Active threads first
     for th in parent.threads:
         yield th
-
-    async def _yield(aiter):
-        buf = [t async for t in aiter]
-        for t in reversed(buf):
-            yield t
-    # Then archived public threads
+    # Then archived public threads, re-listed at most once per TTL
+    entry = _archived_threads.get(parent.id)
+    if entry and time.monotonic() - entry[0] < ARCHIVED_THREAD_TTL:
+        for th in entry[1]:
+            yield th
+        return
     try:
         # Fixed: Removed oldest_first parameter and collect all first
         archived = []
@@ -186,7 +234,9 @@ async def iter_all_threads(parent: discord.abc.GuildChannel):
             archived.append(th)
         
         # Reverse to get oldest-first order (since Discord returns newest-first by default)
-        for th in reversed(archived):
+        archived.reverse()
+        _archived_threads[parent.id] = (time.monotonic(), archived)
+        for th in archived:
             yield th
     except discord.Forbidden:
         print(f"[crawler] No access to archived threads in #{parent.name}")
@@ -202,10 +252,6 @@ async def slow_crawl(src_guild, db, build_snippet, db_add_author, db_add_post, b
     """Main crawler loop - runs continuously"""
     global inaccessible_channels
     
-    # Ensure progress table exists
-    await db.executescript(CREATE_PROGRESS_TABLE)
-    await db.commit()
-    
     me = src_guild.get_member(client.user.id) or await src_guild.fetch_member(src_guild._state.user.id)
     cutoff = datetime.utcnow().replace(tzinfo=timezone.utc) - timedelta(days=CUTOFF_DAYS)
     
@@ -234,36 +280,41 @@ async def slow_crawl(src_guild, db, build_snippet, db_add_author, db_add_post, b
             
             channels_processed = 0
             threads_processed = 0
-            
-            # Crawl all text channels
-            for parent in text_like_channels:
-                if parent.id in IGNORED_CHANNELS:
-                    continue
+            sem = asyncio.Semaphore(CRAWL_CONCURRENCY)
+
+            async def crawl_parent(parent):
+                """One channel and its threads; pace_request spaces the fetches"""
+                nonlocal channels_processed, threads_processed
+                async with sem:
+                    channels_processed += 1
+                    print(f"[crawler] 📁 Processing channel #{parent.name} ({channels_processed}/{len(accessible_channels)})")
                     
-                if parent.id in inaccessible_channels:
-                    continue  # Skip silently
+                    await crawl_one(parent, cutoff, me, db, build_snippet, blue_ids, db_add_author, db_add_post)
                     
-                channels_processed += 1
-                print(f"[crawler] 📁 Processing channel #{parent.name} ({channels_processed}/{len(accessible_channels)})")
-                
-                await crawl_one(parent, cutoff, me, db, build_snippet, blue_ids, db_add_author, db_add_post)
-                await asyncio.sleep(REQ_PAUSE)
-                
-                # Count and crawl threads
-                thread_count = 0
-                async for th in iter_all_threads(parent):
-                    # Skip if thread is in inaccessible cache
-                    if th.id in inaccessible_channels:
-                        continue
-                        
-                    thread_count += 1
-                    threads_processed += 1
-                    print(f"[crawler] 🧵 Processing thread #{th.name} (#{thread_count} in #{parent.name})")
-                    await crawl_one(th, cutoff, me, db, build_snippet, blue_ids, db_add_author, db_add_post)
-                    await asyncio.sleep(REQ_PAUSE)
-                
-                if thread_count > 0:
-                    print(f"[crawler] ✅ Completed #{parent.name} - processed {thread_count} threads")
+                    # Count and crawl threads
+                    thread_count = 0
+                    async for th in iter_all_threads(parent):
+                        # Skip if thread is in inaccessible cache
+                        if th.id in inaccessible_channels:
+                            continue
+                            
+                        thread_count += 1
+                        threads_processed += 1
+                        print(f"[crawler] 🧵 Processing thread #{th.name} (#{thread_count} in #{parent.name})")
+                        await crawl_one(th, cutoff, me, db, build_snippet, blue_ids, db_add_author, db_add_post)
+                    
+                    if thread_count > 0:
+                        print(f"[crawler] ✅ Completed #{parent.name} - processed {thread_count} threads")
+            
+            # Crawl all text channels, CRAWL_CONCURRENCY at a time
+            results = await asyncio.gather(
+                *(crawl_parent(parent) for parent in text_like_channels
+                  if parent.id not in IGNORED_CHANNELS and parent.id not in inaccessible_channels),
+                return_exceptions=True
+            )
+            for err in results:
+                if isinstance(err, Exception):
+                    print(f"[crawler] ❌ Error crawling a channel: {err}")
             
             print(f"[crawler] 🏁 Sweep #{sweep_number} complete: {channels_processed} channels, {threads_processed} threads, {save_counter} total messages saved")
             
@@ -300,6 +351,7 @@ def clear_inaccessible_cache():
 
 async def cleanup_old_progress(db, days=30):
     """Clean up old progress entries for channels that no longer exist"""
+    global last_seen_ids
     cutoff_ts = int((time.time() - (days * 24 * 60 * 60)) * 1000)
     cursor = await db.execute(
         "DELETE FROM crawl_progress WHERE updated_at < ?",
@@ -308,5 +360,6 @@ async def cleanup_old_progress(db, days=30):
     deleted = cursor.rowcount
     if deleted > 0:
         await db.commit()
+        last_seen_ids = None   # reload on next use
         print(f"[crawler] Cleaned up {deleted} old progress entries")
     return deleted
@@ -1,10 +1,18 @@
-import aiosqlite, re, time, asyncio, shutil
+import aiosqlite, re, time, asyncio, shutil, discord
 from .config import DB_PATH, REQ_PAUSE
 from pathlib import Path
 from discord import TextChannel, ForumChannel
 DIGITS_ONLY = re.compile(r'^#?\d+$')
+DISCORD_EPOCH_MS = 1420070400000
 
-CREATE_SQL = """
+def snowflake_to_ms(snowflake):
+    """Creation time (ms since the Unix epoch) carried in a Discord snowflake ID"""
+    return (snowflake >> 22) + DISCORD_EPOCH_MS
+
+DB_PAGE_SIZE = 8192   # ~2x the rows per leaf vs. SQLite's 4096 default
+
+CREATE_SQL = f"""
+PRAGMA page_size={DB_PAGE_SIZE};
 PRAGMA journal_mode=WAL;
 CREATE TABLE IF NOT EXISTS posts (
   id        INTEGER PRIMARY KEY,
@@ -12,7 +20,8 @@ CREATE TABLE IF NOT EXISTS posts (
   author_id TEXT,
   ts        INTEGER,
   content   TEXT,
-  replayed  INTEGER DEFAULT 0
+  replayed  INTEGER DEFAULT 0,
+  reply_to_id INTEGER                -- replied-to message not yet quoted in content
 );
 CREATE TABLE IF NOT EXISTS authors(
   author_id TEXT PRIMARY KEY,
@@ -39,14 +48,45 @@ CREATE TABLE IF NOT EXISTS bot_metadata (
   value      TEXT,
   updated_at INTEGER
 );
+CREATE TABLE IF NOT EXISTS repost_mirror (      -- source channel -> mirror
+  src_guild_id INTEGER NOT NULL,
+  src_chan_id  INTEGER NOT NULL,
+  mirror_id    INTEGER NOT NULL,
+  is_thread    INTEGER NOT NULL DEFAULT 0,
+  parent_id    INTEGER,
+  PRIMARY KEY (src_guild_id, src_chan_id)
+);
+CREATE TABLE IF NOT EXISTS repost_webhook (     -- mirror channel -> webhook
+  channel_id INTEGER PRIMARY KEY,
+  url        TEXT NOT NULL
+);
+-- id is the rowid, so this already answers MAX(id) WHERE chan_id=? in one seek
 CREATE INDEX IF NOT EXISTS idx_posts_chan_id ON posts(chan_id);
-CREATE INDEX IF NOT EXISTS idx_posts_author_id ON posts(author_id);
+-- superseded by idx_posts_author_ts, which answers every author_id lookup
+DROP INDEX IF EXISTS idx_posts_author_id;
 CREATE INDEX IF NOT EXISTS idx_posts_ts ON posts(ts);
-CREATE INDEX IF NOT EXISTS idx_posts_replayed ON posts(replayed);
+-- replay_all's backlog in ts order, and its COUNT(*); rows drop out once replayed
+CREATE INDEX IF NOT EXISTS idx_posts_unreplayed_ts ON posts(ts) WHERE replayed = 0;
+DROP INDEX IF EXISTS idx_posts_replayed;
+CREATE INDEX IF NOT EXISTS idx_posts_author_chan_ts ON posts(author_id, chan_id, ts DESC);
+CREATE INDEX IF NOT EXISTS idx_posts_chan_ts ON posts(chan_id, ts DESC);
+-- ascending on purpose: scanned backwards it yields ts DESC, id DESC with no sort
+CREATE INDEX IF NOT EXISTS idx_posts_author_ts ON posts(author_id, ts);
 CREATE INDEX IF NOT EXISTS idx_channels_name   ON channels(name);
 CREATE INDEX IF NOT EXISTS idx_channels_parent ON channels(parent_id);
 """
 
+WRITER_PRAGMAS = (
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA synchronous = NORMAL",        # WAL: fsync at checkpoints, not every commit
+    "PRAGMA cache_size = -65536",         # 64 MB page cache
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 268435456",       # reads come straight from the mapping
+    "PRAGMA journal_size_limit = 67108864",  # trim the WAL back to 64 MB after checkpoints
+    # REPLACE must fire the posts DELETE triggers or derived tables drift
+    "PRAGMA recursive_triggers = ON",
+)
+
 async def open_db():
     """Open database connection and create tables"""
     try:
@@ -59,19 +99,221 @@ async def open_db():
             DB_PATH.write_bytes(SEED_PATH.read_bytes())   # or shutil.copy
 
         db = await aiosqlite.connect(DB_PATH)
+        await ensure_page_size(db)
         await db.executescript(CREATE_SQL)
         
         # Enable foreign keys and optimize settings
-        await db.execute("PRAGMA foreign_keys = ON")
-        await db.execute("PRAGMA synchronous = NORMAL")
-        await db.execute("PRAGMA cache_size = 10000")
-        await db.execute("PRAGMA temp_store = MEMORY")
+        for pragma in WRITER_PRAGMAS:
+            await db.execute(pragma)
         
         return db
     except Exception as e:
         print(f"[DB] Error opening database: {e}")
         raise
 
+async def ensure_page_size(db):
+    """
+    Rebuild an existing database at DB_PAGE_SIZE. page_size only takes effect
+    on a VACUUM outside WAL mode, so drop out of WAL for the rebuild;
+    CREATE_SQL switches it back right after.
+    """
+    row = await fetchone(db, "PRAGMA page_count")
+    if not row or not row[0]:
+        return   # new file – CREATE_SQL sets it before the first table
+    row = await fetchone(db, "PRAGMA page_size")
+    if row[0] == DB_PAGE_SIZE:
+        return
+
+    print(f"[DB] Rebuilding database with {DB_PAGE_SIZE}-byte pages (was {row[0]}) …")
+    t0 = time.time()
+    try:
+        await db.execute("PRAGMA journal_mode=DELETE")
+        await db.execute(f"PRAGMA page_size={DB_PAGE_SIZE}")
+        await db.execute("VACUUM")
+    except aiosqlite.OperationalError as e:
+        # another process (e.g. the viewer) has the file open – the old page
+        # size still works, so try again next start
+        print(f"[DB] Page size migration skipped, will retry next start: {e}")
+        return
+    print(f"[DB] Page size migration done in {time.time() - t0:.1f}s")
+
+# ── Read-only connection pool ──────────────────────────────────────
+# The main connection is the single WAL writer; committed-data lookups on
+# hot paths borrow one of these instead of queueing behind its writes.
+READER_POOL_SIZE = 3
+READER_PRAGMAS = (
+    "PRAGMA cache_size = -16384",     # 16 MB each
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 268435456",   # 256 MB of the file mapped, not copied
+    "PRAGMA query_only = ON",
+)
+_readers = None   # asyncio.Queue of aiosqlite connections, see open_reader_pool
+_reader_count = 0
+READER_CLOSE_TIMEOUT = 10   # seconds close_reader_pool waits for borrowed readers
+
+async def open_reader_pool(size=READER_POOL_SIZE):
+    """Open `size` read-only connections; call after open_db() created the file"""
+    global _readers, _reader_count
+    if _readers is not None:
+        return   # on_ready runs again on every full reconnect
+    _readers = asyncio.Queue()
+    _reader_count = size
+    for _ in range(size):
+        conn = await aiosqlite.connect(f"{DB_PATH.resolve().as_uri()}?mode=ro", uri=True)
+        for pragma in READER_PRAGMAS:
+            await conn.execute(pragma)
+        _readers.put_nowait(conn)
+    print(f"[DB] Opened {size} read-only connections")
+
+async def close_reader_pool():
+    """Close every pooled reader, waiting up to READER_CLOSE_TIMEOUT for borrowed ones"""
+    global _readers
+    if _readers is None:
+        return
+    readers, _readers = _readers, None   # new reads fall back to the main connection
+    for closed in range(_reader_count):
+        try:
+            conn = await asyncio.wait_for(readers.get(), READER_CLOSE_TIMEOUT)
+        except Exception:
+            print(f"[DB] {_reader_count - closed} reader(s) still busy – not closed")
+            return
+        await conn.close()
+
+async def read_fetchone(db, query, params=()):
+    """
+    fetchone on a pooled reader. Readers only see committed rows, so use
+    this for data no pending write of the caller can change. Falls back
+    to `db` when the pool isn't open.
+    """
+    readers = _readers
+    if readers is None:
+        return await fetchone(db, query, params)
+    conn = await readers.get()
+    try:
+        return await fetchone(conn, query, params)
+    finally:
+        readers.put_nowait(conn)   # the queue it came from, even mid-close
+
+async def read_fetchall(db, query, params=()):
+    """fetchall counterpart of read_fetchone"""
+    readers = _readers
+    if readers is None:
+        return await fetchall(db, query, params)
+    conn = await readers.get()
+    try:
+        return await fetchall(conn, query, params)
+    finally:
+        readers.put_nowait(conn)
+
+# ── Write coalescer ────────────────────────────────────────────────
+# Live writes are queued and one task applies them in batches: every
+# statement collected within WRITE_WINDOW seconds (up to WRITE_BATCH) goes
+# out as one executemany per SQL text and a single commit.
+WRITE_BATCH = 100
+WRITE_WINDOW = 0.2
+_write_queue = None
+_writer_task = None
+_STOP = object()   # queued by stop_write_coalescer; the writer flushes and exits
+
+def start_write_coalescer(db):
+    """Start the background task that owns batched writes on `db`"""
+    global _write_queue, _writer_task
+    if _writer_task is not None and not _writer_task.done():
+        return   # on_ready runs again on every full reconnect
+    _write_queue = asyncio.Queue(maxsize=10000)
+    _writer_task = asyncio.create_task(_writer_loop(db, _write_queue), name="db-writer")
+
+async def queue_write(db, query, params=()):
+    """Queue one write; runs and commits it right away if no coalescer is running"""
+    if _write_queue is None:
+        await execute_with_retry(db, query, params)
+        await db.commit()
+        return
+    await _write_queue.put((query, params))
+
+async def _apply_writes(db, batch):
+    grouped = {}   # SQL text -> rows, in first-seen order
+    for query, params in batch:
+        grouped.setdefault(query, []).append(params)
+    try:
+        for query, rows in grouped.items():
+            await execute_with_retry(db, query, rows, many=True)
+    except Exception as e:
+        # The queued statements are all INSERT OR IGNORE / upserts, so rows
+        # that already went in are harmless to repeat; only skip the bad ones
+        print(f"[DB] Batch of {len(batch)} writes failed ({e}); applying one by one")
+        for query, params in batch:
+            try:
+                await execute_with_retry(db, query, params)
+            except Exception as e:
+                print(f"[DB] Dropped queued write {params!r}: {e}")
+    await db.commit()
+
+async def _writer_loop(db, queue):
+    loop = asyncio.get_running_loop()
+    batch = []
+    try:
+        while True:
+            item = await queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stopping = False
+            deadline = loop.time() + WRITE_WINDOW
+            while len(batch) < WRITE_BATCH:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                await _apply_writes(db, batch)
+            except Exception as e:
+                print(f"[DB] Commit of {len(batch)} queued writes failed: {e}")
+            batch = []
+            if stopping:
+                return
+    except asyncio.CancelledError:
+        # client.run() cancels every task on SIGINT/SIGTERM, usually while
+        # we hold a half-collected batch: save it and the rest of the queue
+        while not queue.empty():
+            item = queue.get_nowait()
+            if item is not _STOP:
+                batch.append(item)
+        if batch:
+            try:
+                await _apply_writes(db, batch)
+            except Exception as e:
+                print(f"[DB] Commit of {len(batch)} queued writes at shutdown failed: {e}")
+        raise
+
+async def stop_write_coalescer(db):
+    """Let the writer flush everything queued so far, then stop it"""
+    global _write_queue, _writer_task
+    if _writer_task is None:
+        return
+    queue, task = _write_queue, _writer_task
+    _write_queue = _writer_task = None   # from here on queue_write goes direct
+    if not task.done() and task.get_loop() is asyncio.get_running_loop():
+        await queue.put(_STOP)
+        await task
+        return
+
+    # The loop that ran the writer is gone – apply the leftovers here
+    batch = []
+    while not queue.empty():
+        item = queue.get_nowait()
+        if item is not _STOP:
+            batch.append(item)
+    if batch:
+        await _apply_writes(db, batch)
+
 async def fetchone(db, query, params=()):
     """Execute query and fetch one result"""
     try:
@@ -94,12 +336,14 @@ async def fetchall(db, query, params=()):
         print(f"[DB] Error in fetchall: {e}")
         raise
 
-async def execute_with_retry(db, query, params=(), max_retries=3):
-    """Execute query with retry logic for database locks"""
+async def execute_with_retry(db, query, params=(), max_retries=3, many=False):
+    """Execute query with retry logic for database locks (many=True: executemany)"""
     import asyncio
     
     for attempt in range(max_retries):
         try:
+            if many:
+                return await db.executemany(query, params)
             cursor = await db.execute(query, params)
             return cursor
         except aiosqlite.OperationalError as e:
@@ -181,6 +425,21 @@ async def ensure_parent_column(db):
     await db.commit()
     print("[DB] parent_id column added successfully")
 
+async def ensure_reply_column(db):
+    """
+    Add posts.reply_to_id exactly once.
+    Safe to call at every startup.
+    """
+    rows = await fetchall(db, "PRAGMA table_info(posts)")
+    if any(r[1] == 'reply_to_id' for r in rows):
+        return  # already migrated
+
+    print("[DB] Adding reply_to_id column to posts …")
+    await execute_with_retry(
+        db, "ALTER TABLE posts ADD COLUMN reply_to_id INTEGER")
+    await db.commit()
+    print("[DB] reply_to_id column added successfully")
+
 async def backfill_channel_names(db, client):
     # Fixed: Use fetchall and access by index, not name
     rows = await fetchall(db, 
@@ -359,6 +618,207 @@ async def fix_channel_names_on_startup(db, client, src_guild):
     
     print(f"[Startup] Channel fix complete: {fixed} fixed, {failed} failed")
 
+POSTS_FTS_SQL = """
+CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+  content, content='posts', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS posts_fts_ai AFTER INSERT ON posts BEGIN
+  INSERT INTO posts_fts(rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS posts_fts_ad AFTER DELETE ON posts BEGIN
+  INSERT INTO posts_fts(posts_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS posts_fts_au AFTER UPDATE OF content ON posts BEGIN
+  INSERT INTO posts_fts(posts_fts, rowid, content) VALUES ('delete', old.id, old.content);
+  INSERT INTO posts_fts(rowid, content) VALUES (new.id, new.content);
+END;
+"""
+
+async def ensure_posts_fts(db):
+    """
+    Create the posts_fts full-text index (trigram, so matching stays
+    case-insensitive substring search) and back-fill it exactly once.
+    Safe to call at every startup; skipped if SQLite lacks FTS5.
+    """
+    try:
+        await db.executescript(POSTS_FTS_SQL)
+    except aiosqlite.OperationalError as e:
+        print(f"[DB] FTS5 unavailable, viewer will search without it: {e}")
+        return
+
+    done = await fetchone(db, "SELECT value FROM bot_metadata WHERE key = 'posts_fts_v1'")
+    if done:
+        return
+
+    print("[DB] Building posts_fts index …")
+    await db.execute("INSERT INTO posts_fts(posts_fts) VALUES ('rebuild')")
+    await db.execute(
+        "INSERT OR REPLACE INTO bot_metadata (key, value, updated_at) VALUES (?, ?, ?)",
+        ('posts_fts_v1', 'completed', int(time.time()))
+    )
+    await db.commit()
+    print("[DB] posts_fts index built")
+
+# Same escaping as html.escape(text, quote=False): safe as element content
+_ESCAPED_CONTENT = "replace(replace(replace(COALESCE({0}.content, ''), '&', '&amp;'), '<', '&lt;'), '>', '&gt;')"
+
+POST_HTML_SQL = f"""
+CREATE TABLE IF NOT EXISTS post_html (          -- pre-escaped content for the viewer
+  id   INTEGER PRIMARY KEY,
+  html TEXT NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS post_html_ai AFTER INSERT ON posts BEGIN
+  INSERT OR REPLACE INTO post_html (id, html) VALUES (new.id, {_ESCAPED_CONTENT.format('new')});
+END;
+CREATE TRIGGER IF NOT EXISTS post_html_au AFTER UPDATE OF content ON posts BEGIN
+  INSERT OR REPLACE INTO post_html (id, html) VALUES (new.id, {_ESCAPED_CONTENT.format('new')});
+END;
+CREATE TRIGGER IF NOT EXISTS post_html_ad AFTER DELETE ON posts BEGIN
+  DELETE FROM post_html WHERE id = old.id;
+END;
+"""
+
+async def ensure_post_html(db):
+    """
+    Create the post_html cache + triggers and back-fill it exactly once.
+    Safe to call at every startup.
+    """
+    await db.executescript(POST_HTML_SQL)
+
+    done = await fetchone(db, "SELECT value FROM bot_metadata WHERE key = 'post_html_v1'")
+    if done:
+        return
+
+    print("[DB] Building post_html cache …")
+    await db.execute(f"""
+        INSERT OR REPLACE INTO post_html (id, html)
+        SELECT p.id, {_ESCAPED_CONTENT.format('p')} FROM posts p
+    """)
+    await db.execute(
+        "INSERT OR REPLACE INTO bot_metadata (key, value, updated_at) VALUES (?, ?, ?)",
+        ('post_html_v1', 'completed', int(time.time()))
+    )
+    await db.commit()
+    print("[DB] post_html cache built")
+
+POST_COUNTS_SQL = """
+CREATE TABLE IF NOT EXISTS post_day_counts (    -- posts per UTC day, for /api/stats
+  day   TEXT PRIMARY KEY,
+  count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS author_post_counts ( -- posts per author, for /api/stats
+  author_id TEXT PRIMARY KEY,
+  count     INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS post_counts_ai AFTER INSERT ON posts BEGIN
+  INSERT INTO post_day_counts (day, count) VALUES (DATE(new.ts/1000, 'unixepoch'), 1)
+    ON CONFLICT(day) DO UPDATE SET count = count + 1;
+  INSERT INTO author_post_counts (author_id, count) VALUES (new.author_id, 1)
+    ON CONFLICT(author_id) DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS post_counts_ad AFTER DELETE ON posts BEGIN
+  UPDATE post_day_counts SET count = count - 1 WHERE day = DATE(old.ts/1000, 'unixepoch');
+  UPDATE author_post_counts SET count = count - 1 WHERE author_id = old.author_id;
+END;
+"""
+
+async def ensure_post_counts(db):
+    """
+    Create the materialized stats counters + triggers and back-fill them once.
+    Safe to call at every startup.
+    """
+    await db.executescript(POST_COUNTS_SQL)
+
+    done = await fetchone(db, "SELECT value FROM bot_metadata WHERE key = 'post_counts_v1'")
+    if done:
+        return
+
+    print("[DB] Building post count tables …")
+    await db.execute("DELETE FROM post_day_counts")
+    await db.execute("""
+        INSERT INTO post_day_counts (day, count)
+        SELECT DATE(ts/1000, 'unixepoch'), COUNT(*) FROM posts GROUP BY 1
+    """)
+    await db.execute("DELETE FROM author_post_counts")
+    await db.execute("""
+        INSERT INTO author_post_counts (author_id, count)
+        SELECT author_id, COUNT(*) FROM posts GROUP BY author_id
+    """)
+    await db.execute(
+        "INSERT OR REPLACE INTO bot_metadata (key, value, updated_at) VALUES (?, ?, ?)",
+        ('post_counts_v1', 'completed', int(time.time()))
+    )
+    await db.commit()
+    print("[DB] post count tables built")
+
+AUTHOR_DISPLAY_SQL = """
+CREATE TABLE IF NOT EXISTS author_display (     -- gm_names > authors > 'Unknown'
+  author_id    TEXT PRIMARY KEY,
+  display_name TEXT NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS author_display_ai AFTER INSERT ON authors BEGIN
+  INSERT OR REPLACE INTO author_display (author_id, display_name)
+  VALUES (new.author_id,
+          COALESCE((SELECT gm_name FROM gm_names WHERE author_id = new.author_id),
+                   new.author_name, 'Unknown'));
+END;
+CREATE TRIGGER IF NOT EXISTS author_display_au AFTER UPDATE OF author_name ON authors BEGIN
+  INSERT OR REPLACE INTO author_display (author_id, display_name)
+  VALUES (new.author_id,
+          COALESCE((SELECT gm_name FROM gm_names WHERE author_id = new.author_id),
+                   new.author_name, 'Unknown'));
+END;
+CREATE TRIGGER IF NOT EXISTS author_display_ad AFTER DELETE ON authors BEGIN
+  DELETE FROM author_display WHERE author_id = old.author_id;
+END;
+CREATE TRIGGER IF NOT EXISTS author_display_gi AFTER INSERT ON gm_names BEGIN
+  INSERT OR REPLACE INTO author_display (author_id, display_name)
+  SELECT author_id, COALESCE(new.gm_name, author_name, 'Unknown')
+  FROM authors WHERE author_id = new.author_id;
+END;
+CREATE TRIGGER IF NOT EXISTS author_display_gu AFTER UPDATE ON gm_names BEGIN
+  INSERT OR REPLACE INTO author_display (author_id, display_name)
+  SELECT author_id, COALESCE(new.gm_name, author_name, 'Unknown')
+  FROM authors WHERE author_id = new.author_id;
+END;
+CREATE TRIGGER IF NOT EXISTS author_display_gd AFTER DELETE ON gm_names BEGIN
+  INSERT OR REPLACE INTO author_display (author_id, display_name)
+  SELECT author_id, COALESCE(author_name, 'Unknown')
+  FROM authors WHERE author_id = old.author_id;
+END;
+"""
+
+async def ensure_author_display(db):
+    """
+    Create the denormalized author_display table + triggers and resync it.
+    The table is tiny, so the full resync is cheap and safe every startup.
+    """
+    await db.executescript(AUTHOR_DISPLAY_SQL)
+    await db.execute("""
+        INSERT OR REPLACE INTO author_display (author_id, display_name)
+        SELECT a.author_id, COALESCE(g.gm_name, a.author_name, 'Unknown')
+        FROM authors a
+        LEFT JOIN gm_names g ON a.author_id = g.author_id
+    """)
+    await db.commit()
+
+async def ensure_analyzed(db, version='search_indexes_v3'):
+    """
+    Run ANALYZE once per index-set version so the planner picks the
+    composite search indexes. Bump `version` when indexes change.
+    """
+    done = await fetchone(db, "SELECT value FROM bot_metadata WHERE key = ?", (version,))
+    if done:
+        return
+
+    print("[DB] Analyzing tables for the query planner …")
+    await db.execute("ANALYZE")
+    await db.execute(
+        "INSERT OR REPLACE INTO bot_metadata (key, value, updated_at) VALUES (?, ?, ?)",
+        (version, 'completed', int(time.time()))
+    )
+    await db.commit()
+
 async def ensure_bot_metadata_columns(db):
     """
     Make sure bot_metadata has   key, value, updated_at.
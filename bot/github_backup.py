@@ -1,9 +1,62 @@
-import base64, time, requests
+import base64, gzip, sqlite3, time, requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from .config import GITHUB_TOKEN, DB_PATH
 
 REPO   = "Nisugi/GSIV-BlueTracker"
 BRANCH = "main"
 
+_session = None    # keep-alive session reused by every backup
+
+def get_session():
+    """Return the shared GitHub API session, creating it on first use"""
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        _session.headers["Authorization"] = f"Bearer {GITHUB_TOKEN}"
+        # Transient 5xx retry with backoff. POSTs included: blobs and trees
+        # are content-addressed, and a repeated commit is just left unreferenced
+        retry = Retry(total=3, backoff_factor=2, status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=None, raise_on_status=False)
+        _session.mount("https://", HTTPAdapter(max_retries=retry))
+    return _session
+
+def scrub_secrets(path):
+    """
+    Blank out what must never reach the backup repo: repost_webhook URLs
+    carry the webhook token. secure_delete zeroes the freed pages so the
+    rows can't be recovered from the file; the bot re-saves each webhook
+    the next time it resolves it.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA secure_delete = ON")
+        conn.execute("DELETE FROM repost_webhook")
+        conn.commit()
+    except sqlite3.OperationalError:
+        pass   # pre-webhook-cache database – nothing to scrub
+    finally:
+        conn.close()
+
+def snapshot_db():
+    """
+    Gzipped, consistent copy of the live database. VACUUM INTO reads one
+    transaction snapshot (WAL pages included) without blocking the bot's
+    writer, and writes it compacted; the raw file alone can be torn or stale.
+    """
+    tmp = DB_PATH.with_name(DB_PATH.name + ".backup")
+    tmp.unlink(missing_ok=True)
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        conn.execute("VACUUM INTO ?", (str(tmp),))
+    finally:
+        conn.close()
+    try:
+        scrub_secrets(tmp)
+        return gzip.compress(tmp.read_bytes(), compresslevel=6)
+    finally:
+        tmp.unlink(missing_ok=True)
+
 def github_backup(label="auto"):
     """Upload database backup to GitHub repository"""
     if not GITHUB_TOKEN:
@@ -14,28 +67,28 @@ def github_backup(label="auto"):
         print("[backup] Database file doesn't exist – skipping")
         return
 
+    # one keep-alive connection for all five API calls
+    session = get_session()
     try:
         ts = time.strftime("%Y%m%d-%H%M%S")
-        name = f"posts-{ts}-{label}.sqlite3"
-        headers = {"Authorization": f"Bearer {GITHUB_TOKEN}"}
+        name = f"posts-{ts}-{label}.sqlite3.gz"
 
         # Get SHA of latest commit
         print(f"[backup] Starting backup: {name}")
-        base_response = requests.get(
+        base_response = session.get(
             f"https://api.github.com/repos/{REPO}/git/refs/heads/{BRANCH}",
-            headers=headers,
             timeout=30
         )
         base_response.raise_for_status()
         base_sha = base_response.json()["object"]["sha"]
 
-        # Create blob from DB file
-        print("[backup] Creating blob...")
-        blob_response = requests.post(
+        # Create blob from a compressed snapshot of the DB
+        data = snapshot_db()
+        print(f"[backup] Creating blob ({len(data) / (1024 * 1024):.1f} MB gzipped)...")
+        blob_response = session.post(
             f"https://api.github.com/repos/{REPO}/git/blobs",
-            headers=headers,
             json={
-                "content": base64.b64encode(DB_PATH.read_bytes()).decode(),
+                "content": base64.b64encode(data).decode(),
                 "encoding": "base64"
             },
             timeout=60
@@ -45,9 +98,8 @@ def github_backup(label="auto"):
 
         # Create tree object
         print("[backup] Creating tree...")
-        tree_response = requests.post(
+        tree_response = session.post(
             f"https://api.github.com/repos/{REPO}/git/trees",
-            headers=headers,
             json={
                 "base_tree": base_sha,
                 "tree": [{
@@ -64,9 +116,8 @@ def github_backup(label="auto"):
 
         # Create commit
         print("[backup] Creating commit...")
-        commit_response = requests.post(
+        commit_response = session.post(
             f"https://api.github.com/repos/{REPO}/git/commits",
-            headers=headers,
             json={
                 "message": f"DB backup {name}",
                 "tree": tree_sha,
@@ -79,9 +130,8 @@ def github_backup(label="auto"):
 
         # Update branch reference
         print("[backup] Updating branch...")
-        ref_response = requests.patch(
+        ref_response = session.patch(
             f"https://api.github.com/repos/{REPO}/git/refs/heads/{BRANCH}",
-            headers=headers,
             json={"sha": commit_sha},
             timeout=30
         )
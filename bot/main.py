@@ -1,8 +1,9 @@
 import discord, asyncio, time, signal, sys
 from .config import (TOKEN, SOURCE_GUILD_ID, AGGREGATOR_GUILD_ID, CENTRAL_CHAN_ID,
                      REPLAY_MODE, SEED_BLUE_IDS, DB_PATH, API_PAUSE)
-from .db import open_db, fetchone, fetchall, ensure_parent_column, backfill_channel_names, prime_channel_table, fix_channel_names_on_startup, ensure_bot_metadata_columns
-from .repost import should_repost, repost_live, build_snippet
+from .db import open_db, snowflake_to_ms, start_write_coalescer, stop_write_coalescer, queue_write, ensure_reply_column, open_reader_pool, close_reader_pool, fetchone, read_fetchone, fetchall, read_fetchall, ensure_parent_column, backfill_channel_names, prime_channel_table, fix_channel_names_on_startup, ensure_bot_metadata_columns, ensure_posts_fts, ensure_analyzed, ensure_author_display, ensure_post_html, ensure_post_counts
+from .repost import (should_repost, repost_live, build_snippet, reply_quote, strip_reply_quote, jump_url, close_session,
+                     load_repost_caches)
 from .crawler import slow_crawl
 from .config import FULL_BACKFILL_RUN
 from .github_backup import safe_github_backup
@@ -13,26 +14,29 @@ db = None
 blue_ids = set(SEED_BLUE_IDS)
 
 # ── Helper functions ────────────────────────────────────────────────
+# Both go through the write coalescer: batched, committed within WRITE_WINDOW
 async def db_add_post(m, snippet, already_replayed=False):
     """Add post to database"""
-    await db.execute(
+    await queue_write(
+        db,
         "INSERT OR IGNORE INTO channels (chan_id) VALUES (?)",
         (str(m.channel.id),)
     )
-    await db.execute("INSERT OR IGNORE INTO posts VALUES (?,?,?,?,?,?)",
-                     (m.id, m.channel.id, m.author.id,
-                      int(m.created_at.timestamp()*1000), snippet,
-                      1 if already_replayed else 0))
+    await queue_write(db, "INSERT OR IGNORE INTO posts "
+                      "(id, chan_id, author_id, ts, content, replayed) VALUES (?,?,?,?,?,?)",
+                      (m.id, m.channel.id, m.author.id,
+                       snowflake_to_ms(m.id), snippet,
+                       1 if already_replayed else 0))
 
 async def db_add_author(u):
     """Add or update author in database"""
-    await db.execute("INSERT OR IGNORE INTO authors VALUES (?,?)",
-                     (u.id, u.display_name or u.name))
-    # Update name if it was previously NULL
-    await db.execute(
-        "UPDATE authors SET author_name = ? "
-        "WHERE author_id = ? AND author_name IS NULL",
-        (u.display_name or u.name, u.id)
+    # Insert, or fill in the name if it was previously NULL – one statement
+    await queue_write(
+        db,
+        "INSERT INTO authors (author_id, author_name) VALUES (?, ?) "
+        "ON CONFLICT(author_id) DO UPDATE SET author_name = excluded.author_name "
+        "WHERE authors.author_name IS NULL",
+        (u.id, u.display_name or u.name)
     )
 
 async def initialize_gm_names(db):
@@ -64,11 +68,21 @@ async def list_gm_names(db):
         print(f"{gm_name}: {author_id}{note_str}")
       
 # ── One-time replay function ───────────────────────────────────────
+REPLAY_BATCH = 25   # replayed flags committed per fsync
+REPLAY_PAGE = 500   # unreplayed rows fetched per query
+# served in order by idx_posts_unreplayed_ts
+REPLAY_PAGE_SQL = (
+    "SELECT id, chan_id, author_id, content, reply_to_id, ts "
+    "FROM posts "
+    "WHERE replayed = 0 AND (ts, id) > (?, ?) "
+    f"ORDER BY ts, id LIMIT {REPLAY_PAGE}"
+)
+
 async def replay_all(dst_guild):
     """Replay all unreplayed messages from database"""
     print("► Starting full replay …")
     
-    progress_row = await fetchone(db, "SELECT COUNT(*) FROM posts WHERE replayed = 0")
+    progress_row = await read_fetchone(db, "SELECT COUNT(*) FROM posts WHERE replayed = 0")
     total_to_replay = progress_row[0] if progress_row else 0
     if total_to_replay == 0:
         print("► Nothing to replay.")
@@ -76,14 +90,37 @@ async def replay_all(dst_guild):
         
     start_time = time.time()
     count = 0
+    pending_ids = []   # handled this batch, flagged replayed in one commit
+
+    # the authors table is small: one query instead of one per message
+    from .db import get_gm_display_name
+    author_names = dict(await read_fetchall(db, "SELECT author_id, author_name FROM authors"))
+    display_names = {}   # author_id -> resolved name for this replay
+
+    async def resolve_name(author_id):
+        """Get proper GM name (resolved once per author)"""
+        name = display_names.get(author_id)
+        if name is None:
+            fallback_name = author_names.get(author_id) or f"ID {author_id}"
+            name = display_names[author_id] = await get_gm_display_name(db, author_id, fallback_name)
+        return name
+
+    async def flush_replayed():
+        if pending_ids:
+            await db.executemany("UPDATE posts SET replayed = 1 WHERE id = ?",
+                                 [(i,) for i in pending_ids])
+            await db.commit()
+            pending_ids.clear()
     
-    async with db.execute(
-        "SELECT id, chan_id, author_id, content "
-        "FROM posts "
-        "WHERE replayed = 0 "
-        "ORDER BY ts ASC"
-    ) as cur:
-        async for msg_id, chan_id, author_id, body in cur:
+    # Pages of REPLAY_PAGE rows, keyed on the last (ts, id) handled, so no
+    # cursor stays open across the UPDATEs and nothing is sorted in bulk
+    last = (-1, -1)
+    while True:
+        rows = await read_fetchall(db, REPLAY_PAGE_SQL, last)
+        if not rows:
+            break
+        last = (rows[-1][5], rows[-1][0])
+        for msg_id, chan_id, author_id, body, reply_to_id, _ in rows:
             try:
                 # Get source channel
                 src_ch = client.get_channel(int(chan_id))
@@ -92,24 +129,34 @@ async def replay_all(dst_guild):
                         src_ch = await client.fetch_channel(int(chan_id))
                     except discord.NotFound:
                         print(f"[replay] Channel {chan_id} not found, skipping message {msg_id}")
-                        await db.execute("UPDATE posts SET replayed = 1 WHERE id = ?", (msg_id,))
+                        pending_ids.append(msg_id)
                         continue
 
                 src_guild_name = src_ch.guild.name
                 src_channel_name = src_ch.name
 
-                # Get proper GM name
-                from .db import get_gm_display_name
-                row = await fetchone(db, "SELECT author_name FROM authors WHERE author_id = ?", (author_id,))
-                fallback_name = row[0] if row and row[0] else f"ID {author_id}"
-                display_name = await get_gm_display_name(db, author_id, fallback_name)
+                display_name = await resolve_name(author_id)
                 avatar = None  # Skip avatar fetch for performance during replay
 
                 # Build message content
-                jump = f"https://discord.com/channels/{src_ch.guild.id}/{chan_id}/{msg_id}"
+                jump = jump_url(src_ch.guild.id, chan_id, msg_id)
                 snippet = body or "(embed/attachment only)"
                 if len(snippet) > 200:
                     snippet = snippet[:197] + "…"
+                if reply_to_id:
+                    # the crawler left the parent out; quote it from our copy
+                    # (minus its own quote header), else fetch it – replay is paced
+                    parent = await read_fetchone(
+                        db, "SELECT author_id, content FROM posts WHERE id = ?", (reply_to_id,))
+                    if parent:
+                        snippet = reply_quote(await resolve_name(parent[0]),
+                                              strip_reply_quote(parent[1])) + snippet
+                    else:
+                        try:
+                            parent = await src_ch.fetch_message(reply_to_id)
+                            snippet = reply_quote(parent.author.display_name, parent.content) + snippet
+                        except (discord.NotFound, discord.Forbidden, discord.HTTPException):
+                            pass
 
                 full_content = (
                     f"{display_name} ({src_guild_name} • #{src_channel_name}):\n"
@@ -117,12 +164,11 @@ async def replay_all(dst_guild):
                 )
 
                 # Send to mirror channels
-                from .repost import ensure_mirror, get_webhook, safe_webhook_send
+                from .repost import ensure_mirror, send_via_webhook
                 
-                mirror = await ensure_mirror(dst_guild, src_ch)
+                mirror = await ensure_mirror(dst_guild, src_ch, db)
                 is_thread = isinstance(mirror, discord.Thread)
                 parent = mirror.parent if is_thread else mirror
-                wh = await get_webhook(parent)
                 
                 kwargs = dict(
                     content=full_content,
@@ -133,11 +179,12 @@ async def replay_all(dst_guild):
                 if is_thread:
                     kwargs["thread"] = mirror
 
-                # Mark as replayed
-                await db.execute("UPDATE posts SET replayed = 1 WHERE id = ?", (msg_id,))
-                await db.commit()
-              
-                await safe_webhook_send(wh, **kwargs)
+                await send_via_webhook(parent, db, **kwargs)
+
+                # Mark as replayed; a crash resends at most one batch
+                pending_ids.append(msg_id)
+                if len(pending_ids) >= REPLAY_BATCH:
+                    await flush_replayed()
 
                 count += 1
                 elapsed = time.time() - start_time
@@ -154,16 +201,19 @@ async def replay_all(dst_guild):
             except Exception as e:
                 print(f"[replay] Error processing message {msg_id}: {e}")
                 # Mark as replayed to avoid infinite retry
-                await db.execute("UPDATE posts SET replayed = 1 WHERE id = ?", (msg_id,))
-                await db.commit()
+                pending_ids.append(msg_id)
 
+    await flush_replayed()
     print("► Replay complete")
 
 # ── Graceful shutdown handling ─────────────────────────────────────
 async def cleanup_on_exit():
     """Clean up resources on shutdown"""
     print("\n[Bot] Shutting down gracefully...")
+    await close_session()
+    await close_reader_pool()
     if db:
+        await stop_write_coalescer(db)
         await db.close()
     if not client.is_closed():
         await client.close()
@@ -184,6 +234,14 @@ async def on_ready():
         await ensure_bot_metadata_columns(db)
         # Ensure parent_id column exists before any operations
         await ensure_parent_column(db)
+        await ensure_reply_column(db)
+        await ensure_posts_fts(db)
+        await ensure_author_display(db)
+        await ensure_post_html(db)
+        await ensure_post_counts(db)
+        await ensure_analyzed(db)
+        await open_reader_pool()
+        start_write_coalescer(db)
         
         if FULL_BACKFILL_RUN:
         # clear progress so every channel starts fresh
@@ -207,14 +265,7 @@ async def on_ready():
         await db.commit()
 
         # Initialize GM name overrides
-        from .config import GM_NAME_OVERRIDES
-        for author_id, gm_name in GM_NAME_OVERRIDES.items():
-            await db.execute(
-                "INSERT OR REPLACE INTO gm_names (author_id, gm_name) VALUES (?, ?)",
-                (author_id, gm_name)
-            )
-        await db.commit()
-        print(f"[DB] Initialized {len(GM_NAME_OVERRIDES)} GM name overrides")
+        await initialize_gm_names(db)
         
         print(f"[Self-Bot] Logged in as {client.user} ({client.user.id})")
 
@@ -226,6 +277,7 @@ async def on_ready():
             src_guild = client.get_guild(SOURCE_GUILD_ID)
             dst_guild = client.get_guild(AGGREGATOR_GUILD_ID)
 
+        await load_repost_caches(db, client)
         await fix_channel_names_on_startup(db, client, src_guild)
         await prime_channel_table(db, src_guild)
 
@@ -275,7 +327,6 @@ async def on_message(m: discord.Message):
         await db_add_author(m.author)
         snippet = await build_snippet(m)
         await db_add_post(m, snippet, already_replayed=True)
-        await db.commit()
         
     except Exception as e:
         print(f"[Bot] Error processing message {m.id}: {e}")
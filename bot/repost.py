@@ -1,9 +1,39 @@
-import discord, asyncio
+import discord, asyncio, aiohttp
 from .config import CENTRAL_CHAN_ID, CREATE_COOLDOWN, TRACKED, IGNORED_CHANNELS
 
 # Caches
 mirror_cache = {}  # (src_guild_id, src_chan_id) -> mirror channel/thread
 wh_cache = {}      # mirror_chan_id -> webhook
+_jump_prefix = {}  # (guild_id, chan_id) -> "https://discord.com/channels/<guild>/<chan>/"
+_pending = set()   # background tasks, held so they aren't garbage-collected mid-flight
+_by_name = {}      # (scope_id, name) -> destination category / channel / thread
+
+_JUMP_BASE = "https://discord.com/channels"
+
+_session = None    # one pooled HTTP session shared by every webhook
+
+def get_session():
+    """Return the shared webhook session, creating it on first use"""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(
+            limit=100, ttl_dns_cache=300, keepalive_timeout=75))
+    return _session
+
+async def close_session():
+    """Close the shared webhook session (called on shutdown)"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+def jump_url(guild_id, chan_id, msg_id):
+    """Build a message jump URL, formatting the guild/channel prefix only once"""
+    key = (guild_id, chan_id)
+    prefix = _jump_prefix.get(key)
+    if prefix is None:
+        prefix = _jump_prefix[key] = f"{_JUMP_BASE}/{guild_id}/{chan_id}/"
+    return prefix + str(msg_id)
 
 def should_repost(msg, blue_ids):
     """Check if message should be reposted based on roles or blue_ids"""
@@ -11,8 +41,8 @@ def should_repost(msg, blue_ids):
         return False
     if msg.author.id in blue_ids:          
         return True
-    role_ids = {r.id for r in getattr(msg.author, "roles", [])}
-    return bool(role_ids & TRACKED)
+    # isdisjoint stops at the first tracked role, no set is built
+    return not TRACKED.isdisjoint(r.id for r in getattr(msg.author, "roles", ()))
 
 async def make_read_only(channel: discord.TextChannel):
     """Make a channel read-only for @everyone"""
@@ -26,7 +56,80 @@ async def make_read_only(channel: discord.TextChannel):
     except discord.Forbidden:
         print(f"[repost] Cannot make #{channel.name} read-only - missing permissions")
 
-async def ensure_mirror(dst_guild, src_channel):
+async def remember_mirror(db, key, mirror):
+    """Persist a resolved mirror so the next start-up doesn't re-discover it"""
+    if db is None:
+        return
+    is_thread = isinstance(mirror, discord.Thread)
+    try:
+        await db.execute(
+            "INSERT OR REPLACE INTO repost_mirror "
+            "(src_guild_id, src_chan_id, mirror_id, is_thread, parent_id) VALUES (?, ?, ?, ?, ?)",
+            (key[0], key[1], mirror.id, 1 if is_thread else 0,
+             mirror.parent_id if is_thread else None)
+        )
+        await db.commit()
+    except Exception as e:
+        print(f"[repost] Failed to persist mirror for {key[1]}: {e}")
+
+async def remember_webhook(db, channel_id, wh):
+    """Persist a webhook URL so it can be rebuilt without a REST call"""
+    if db is None or not wh.token:
+        return
+    try:
+        await db.execute(
+            "INSERT OR REPLACE INTO repost_webhook (channel_id, url) VALUES (?, ?)",
+            (channel_id, wh.url)
+        )
+        await db.commit()
+    except Exception as e:
+        print(f"[repost] Failed to persist webhook for {channel_id}: {e}")
+
+async def forget_webhook(db, channel_id):
+    """Drop a webhook that Discord no longer knows about"""
+    wh_cache.pop(channel_id, None)
+    if db is not None:
+        await db.execute("DELETE FROM repost_webhook WHERE channel_id = ?", (channel_id,))
+        await db.commit()
+
+async def load_repost_caches(db, client):
+    """Rehydrate mirror_cache / wh_cache from the database at start-up"""
+    mirrors = hooks = 0
+    async with db.execute(
+        "SELECT src_guild_id, src_chan_id, mirror_id FROM repost_mirror"
+    ) as cur:
+        async for src_guild_id, src_chan_id, mirror_id in cur:
+            mirror = client.get_channel(mirror_id)
+            if mirror is None:
+                continue  # deleted or not cached – ensure_mirror will re-resolve it
+            mirror_cache[(src_guild_id, src_chan_id)] = mirror
+            mirrors += 1
+
+    async with db.execute("SELECT channel_id, url FROM repost_webhook") as cur:
+        async for channel_id, url in cur:
+            try:
+                wh_cache[channel_id] = discord.Webhook.from_url(url, session=get_session())
+                hooks += 1
+            except ValueError:
+                continue
+
+    print(f"[repost] Restored {mirrors} mirrors and {hooks} webhooks from database")
+
+def _find_named(scope_id, name, candidates, lookup):
+    """
+    Dict-backed discord.utils.get(candidates(), name=name). A miss, or a
+    hit since renamed or deleted, re-indexes the scope in one pass.
+    """
+    key = (scope_id, name)
+    found = _by_name.get(key)
+    if found is not None and found.name == name and lookup(found.id) is not None:
+        return found
+    _by_name.pop(key, None)
+    for obj in reversed(candidates()):   # first match wins, as with utils.get
+        _by_name[(scope_id, obj.name)] = obj
+    return _by_name.get(key)
+
+async def ensure_mirror(dst_guild, src_channel, db=None):
     """Create/get mirror channel or thread in destination guild"""
     key = (src_channel.guild.id, src_channel.id)
     if key in mirror_cache: 
@@ -36,21 +139,27 @@ async def ensure_mirror(dst_guild, src_channel):
     cat_name = parent_src.category.name if parent_src.category else "No-Category"
 
     # Find or create category
-    category = discord.utils.get(dst_guild.categories, name=cat_name)
+    category = _find_named(dst_guild.id, cat_name, lambda: dst_guild.categories, dst_guild.get_channel)
     if not category:
         try:
             category = await dst_guild.create_category(cat_name)
+            _by_name[(dst_guild.id, cat_name)] = category
             await asyncio.sleep(CREATE_COOLDOWN)
         except discord.HTTPException as e:
             print(f"[repost] Failed to create category {cat_name}: {e}")
             raise
 
     # Find or create parent channel
-    mirror_parent = discord.utils.get(category.text_channels, name=parent_src.name)
+    mirror_parent = _find_named(category.id, parent_src.name, lambda: category.text_channels, dst_guild.get_channel)
     if not mirror_parent:
         try:
             mirror_parent = await category.create_text_channel(parent_src.name)
-            await make_read_only(mirror_parent)
+            _by_name[(category.id, parent_src.name)] = mirror_parent
+            # apply the permission overwrite concurrently with the cooldown
+            task = asyncio.create_task(make_read_only(mirror_parent),
+                                       name=f"read-only-{mirror_parent.id}")
+            _pending.add(task)
+            task.add_done_callback(_pending.discard)
             await asyncio.sleep(CREATE_COOLDOWN)
         except discord.HTTPException as e:
             print(f"[repost] Failed to create channel {parent_src.name}: {e}")
@@ -59,10 +168,11 @@ async def ensure_mirror(dst_guild, src_channel):
     # If source is not a thread, return the parent channel
     if not isinstance(src_channel, discord.Thread):
         mirror_cache[key] = mirror_parent
+        await remember_mirror(db, key, mirror_parent)
         return mirror_parent
 
     # Find or create thread
-    mirror_thread = discord.utils.get(mirror_parent.threads, name=src_channel.name)
+    mirror_thread = _find_named(mirror_parent.id, src_channel.name, lambda: mirror_parent.threads, dst_guild.get_thread)
     if not mirror_thread:
         try:
             mirror_thread = await mirror_parent.create_thread(
@@ -70,52 +180,111 @@ async def ensure_mirror(dst_guild, src_channel):
                 type=discord.ChannelType.public_thread,
                 auto_archive_duration=src_channel.auto_archive_duration
             )
+            _by_name[(mirror_parent.id, src_channel.name)] = mirror_thread
             await asyncio.sleep(CREATE_COOLDOWN)
         except discord.HTTPException as e:
             print(f"[repost] Failed to create thread {src_channel.name}: {e}")
             raise
 
     mirror_cache[key] = mirror_thread
+    await remember_mirror(db, key, mirror_thread)
     return mirror_thread
 
-async def get_webhook(channel):
+def _pooled(wh):
+    """Rebind a webhook to the shared session so sends reuse keep-alive connections"""
+    if not wh.token:
+        return wh  # can't execute by URL without a token – keep as is
+    return discord.Webhook.from_url(wh.url, session=get_session())
+
+async def get_webhook(channel, db=None):
     """Get or create webhook for channel"""
     if channel.id in wh_cache: 
         return wh_cache[channel.id]
     
     try:
         hooks = await channel.webhooks()
-        for h in hooks:
-            if h.name == "BlueTracker":
-                wh_cache[channel.id] = h
-                return h
-        
-        wh = await channel.create_webhook(name="BlueTracker")
-        wh_cache[channel.id] = wh
+        wh = next((h for h in hooks if h.name == "BlueTracker"), None)
+        if wh is None:
+            wh = await channel.create_webhook(name="BlueTracker")
+        wh = wh_cache[channel.id] = _pooled(wh)
+        await remember_webhook(db, channel.id, wh)
         return wh
     except discord.HTTPException as e:
         print(f"[repost] Failed to create webhook in #{channel.name}: {e}")
         raise
 
+async def send_via_webhook(channel, db=None, **kwargs):
+    """Send through channel's webhook, re-resolving once if a cached one was deleted"""
+    wh = await get_webhook(channel, db)
+    try:
+        return await safe_webhook_send(wh, **kwargs)
+    except discord.NotFound:
+        print(f"[repost] Webhook for #{channel.name} is gone – recreating")
+        await forget_webhook(db, channel.id)
+        wh = await get_webhook(channel, db)
+        return await safe_webhook_send(wh, **kwargs)
+
+def _retry_after(e):
+    """Seconds Discord told us to wait on a 429, or None if it didn't say"""
+    value = None
+    if isinstance(e.json, dict):
+        value = e.json.get("retry_after")
+    headers = getattr(e.response, "headers", None)
+    if value is None and headers:
+        value = headers.get("X-RateLimit-Reset-After") or headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
 async def safe_webhook_send(webhook, max_retries=3, **kwargs):
-    """Send webhook message with retry logic for rate limits"""
+    """Send webhook message, waiting exactly as long as Discord asks on 429s.
+
+    discord.py already queues sends per bucket using the X-RateLimit headers,
+    so we only step in for 429s it surfaces and for transient 5xx errors.
+    """
     for attempt in range(max_retries):
         try:
-            await webhook.send(**kwargs)
-            return
+            return await webhook.send(**kwargs)
         except discord.HTTPException as e:
-            if e.status == 429:  # Rate limited
-                retry_after = getattr(e, 'retry_after', 5)
-                print(f"[webhook] Rate limited, waiting {retry_after}s...")
+            last_attempt = attempt == max_retries - 1
+            if e.status == 429 and not last_attempt:
+                retry_after = _retry_after(e)
+                if retry_after is None:
+                    print(f"[webhook] Rate limited without retry_after: {e}")
+                    raise
+                print(f"[webhook] Rate limited, waiting {retry_after:.2f}s...")
                 await asyncio.sleep(retry_after)
-            elif attempt == max_retries - 1:
-                print(f"[webhook] Failed after {max_retries} attempts: {e}")
-                raise
-            else:
-                await asyncio.sleep(2 ** attempt)  # Exponential backoff
-
-async def build_snippet(msg: discord.Message) -> str:
-    """Build message snippet with reply context if available"""
+                continue
+            if e.status >= 500 and not last_attempt:
+                await asyncio.sleep(0.5 * (attempt + 1))
+                continue
+            print(f"[webhook] Failed after {attempt + 1} attempts: {e}")
+            raise
+
+REPLY_QUOTE_PREFIX = "> **↪️"
+
+def reply_quote(author_name, content):
+    """The quoted-parent header put in front of a reply's snippet"""
+    p_txt = content or "(embed/attachment only)"
+    if len(p_txt) > 100:
+        p_txt = p_txt[:97] + "…"
+    return f"{REPLY_QUOTE_PREFIX}   {author_name}:** {p_txt}\n\n"
+
+def strip_reply_quote(snippet):
+    """A stored snippet without the quoted-parent header reply_quote put in front"""
+    if snippet and snippet.startswith(REPLY_QUOTE_PREFIX):
+        _, sep, rest = snippet.partition("\n\n")
+        if sep:
+            return rest
+    return snippet
+
+async def build_snippet(msg: discord.Message, fetch_parent=True) -> str:
+    """
+    Build message snippet with reply context if available.
+    fetch_parent=False never calls the API: an uncached parent is left out
+    (see unquoted_reply_id).
+    """
     snippet = msg.content or "(embed/attachment only)"
     if len(snippet) > 200:
         snippet = snippet[:197] + "…"
@@ -127,7 +296,7 @@ async def build_snippet(msg: discord.Message) -> str:
     parent = None
     if msg.reference and isinstance(msg.reference.resolved, discord.Message):
         parent = msg.reference.resolved
-    else:
+    elif fetch_parent:
         # Try to fetch the referenced message
         try:
             parent = await msg.channel.fetch_message(msg.reference.message_id)
@@ -136,16 +305,19 @@ async def build_snippet(msg: discord.Message) -> str:
             parent = None
 
     if parent:
-        p_txt = parent.content or "(embed/attachment only)"
-        if len(p_txt) > 100:
-            p_txt = p_txt[:97] + "…"
-        snippet = f"> **↪️   {parent.author.display_name}:** {p_txt}\n\n" + snippet
+        snippet = reply_quote(parent.author.display_name, parent.content) + snippet
 
     return snippet
 
+def unquoted_reply_id(msg: discord.Message):
+    """Parent ID of a reply whose parent build_snippet(fetch_parent=False) left out"""
+    if msg.reference and not isinstance(msg.reference.resolved, discord.Message):
+        return msg.reference.message_id
+    return None
+
 async def repost_live(msg: discord.Message, dst_guild, client, db):
     """Send GM/CM message to both central channel and mirrored hierarchy"""
-    jump = f"https://discord.com/channels/{msg.guild.id}/{msg.channel.id}/{msg.id}"
+    jump = jump_url(msg.guild.id, msg.channel.id, msg.id)
     snippet = await build_snippet(msg)
 
     from .db import get_gm_display_name
@@ -157,9 +329,8 @@ async def repost_live(msg: discord.Message, dst_guild, client, db):
     central = client.get_channel(CENTRAL_CHAN_ID)
     if central:
         try:
-            wh = await get_webhook(central)
-            await safe_webhook_send(
-                wh,
+            await send_via_webhook(
+                central, db,
                 content=body,
                 username=display_name,
                 avatar_url=msg.author.display_avatar.url,
@@ -170,10 +341,9 @@ async def repost_live(msg: discord.Message, dst_guild, client, db):
 
     # Send to mirrored hierarchy
     try:
-        mirror = await ensure_mirror(dst_guild, msg.channel)
+        mirror = await ensure_mirror(dst_guild, msg.channel, db)
         is_thread = isinstance(mirror, discord.Thread)
         parent = mirror.parent if is_thread else mirror
-        wh2 = await get_webhook(parent)
         kwargs = dict(
             content=body,
             username=display_name,
@@ -182,7 +352,7 @@ async def repost_live(msg: discord.Message, dst_guild, client, db):
         )
         if is_thread:
             kwargs["thread"] = mirror
-        await safe_webhook_send(wh2, **kwargs)
+        await send_via_webhook(parent, db, **kwargs)
     except Exception as e:
         print(f"[repost] Failed to send to mirror: {e}")
 
@@ -202,3 +372,11 @@ def cleanup_caches():
         for key in keys_to_remove:
             del wh_cache[key]
         print(f"[repost] Cleaned webhook cache: {len(keys_to_remove)} entries removed")
+
+    if len(_jump_prefix) > 1000:
+        _jump_prefix.clear()
+        print("[repost] Cleared jump URL prefix cache")
+
+    if len(_by_name) > 5000:
+        _by_name.clear()   # rebuilt one scope at a time on demand
+        print("[repost] Cleared mirror name index")
@@ -1,143 +1,413 @@
 # viewer.py - Web-based database viewer for BlueTracker
 
+import base64
+import gzip
+import hashlib
+import html
+import os
+import queue
 import re
 import sqlite3
+import threading
+import time
 from datetime import datetime
+from functools import lru_cache, wraps
 from pathlib import Path
-from flask import Flask, request, jsonify, g, Response
+from flask import Flask, g, request, Response, stream_with_context
+from jinja2 import Template
 from werkzeug.serving import run_simple
 import json
 
-app = Flask(__name__)
+try:
+    import orjson                # Rust-backed encoder, several times faster than json
+except ImportError:
+    orjson = None
+
+try:
+    import ahocorasick           # pyahocorasick – one-pass multi-needle scan
+except ImportError:
+    ahocorasick = None
+
+try:
+    import re2                   # google-re2 – linear time, immune to catastrophic backtracking
+except ImportError:
+    re2 = None
+
+try:
+    import hyperscan             # x86-64 only – all /regex/ terms in one DFA scan
+except ImportError:
+    hyperscan = None
+
+app = Flask(__name__, static_folder=None)   # /static is served from memory below
 app.config['DB_PATH'] = Path("/data/bluetracker.db")
 
 # For local development, you can override the path
 # app.config['DB_PATH'] = Path("./bluetracker.db")
 
-def get_db():
-    """Get database connection for current request"""
-    db = getattr(g, '_database', None)
-    if db is None:
-        db = g._database = sqlite3.connect(
-            app.config['DB_PATH'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        db.row_factory = sqlite3.Row
+# Applied once per connection; WAL lets the bot keep writing while we read
+VIEWER_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=268435456",     # 256 MB memory-mapped reads
+    "PRAGMA cache_size=-65536",       # 64 MB page cache
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA query_only=ON",           # last: the viewer never writes
+)
+
+POOL_SIZE = 8   # idle connections kept; busier bursts open (then close) extras
+_pool = queue.Queue(maxsize=POOL_SIZE)
+
+def _connect():
+    """New read-only viewer connection (falls back to query_only if ro can't open)"""
+    path = Path(app.config['DB_PATH'])
+    # sqlite3 caches prepared statements by SQL text; search SQL only
+    # varies by which filters are present, so a modest cache covers it
+    try:
+        db = sqlite3.connect(path.resolve().as_uri() + '?mode=ro', uri=True,
+                             check_same_thread=False, isolation_level=None,
+                             cached_statements=256)
+    except sqlite3.OperationalError:
+        db = sqlite3.connect(path, check_same_thread=False, isolation_level=None,
+                             cached_statements=256)
+    for pragma in VIEWER_PRAGMAS:
+        db.execute(pragma)
+    db.row_factory = sqlite3.Row
     return db
 
+def get_db():
+    """Borrow a pooled connection for this request (returned on teardown)"""
+    if 'db' not in g:
+        try:
+            g.db = _pool.get_nowait()
+        except queue.Empty:
+            g.db = _connect()
+    return g.db
+
 @app.teardown_appcontext
-def close_connection(exception):
-    """Close database connection at end of request"""
-    db = getattr(g, '_database', None)
-    if db is not None:
+def release_db(exception):
+    """Hand the request's connection back to the pool"""
+    db = g.pop('db', None)
+    if db is None:
+        return
+    if db.in_transaction:
+        db.rollback()   # a stream cut short can leave a read open
+    try:
+        _pool.put_nowait(db)
+    except queue.Full:
         db.close()
 
+AHO_MIN_NEEDLES = 4   # below this, a few `in` scans beat building an automaton
+
+# One left-to-right scan of the query; earlier alternatives win at a position.
+# An OR term runs until whitespace or until one of the other tokens could
+# start, so "x-ray+test" is still `x-` OR (ray AND test) and a stray quote
+# stays part of its word, as when each token class was cut out separately.
+QUERY_TOKEN = re.compile(r'''
+      /(?P<regex>[^/]+)/(?P<flags>[gimsx]*)     # /pattern/flags
+    | "(?P<phrase>[^"]+)"                       # "exact phrase"
+    | (?P<and1>\w+)\s*\+\s*(?P<and2>\w+)        # word + word
+    | (?P<word>(?:(?!/[^/]+/|"[^"]+"|\w+\s*\+\s*\w)\S)+)   # anything else is an OR term
+''', re.VERBOSE)
+
+def _regex_flags(flags):
+    """Map /pattern/flags letters onto re flags"""
+    regex_flags = 0
+    if 'i' in flags:
+        regex_flags |= re.IGNORECASE
+    if 'm' in flags:
+        regex_flags |= re.MULTILINE
+    if 's' in flags:
+        regex_flags |= re.DOTALL
+    return regex_flags
+
+_INLINE_FLAGS = ((re.IGNORECASE, 'i'), (re.MULTILINE, 'm'), (re.DOTALL, 's'))
+
+@lru_cache(maxsize=256)
+def compile_regex(pattern, flags):
+    """
+    Compile one /pattern/flags term, cached across requests. RE2 when it's
+    installed and supports the pattern (no backrefs / lookarounds), else
+    Python's re. Raises re.error if neither accepts it.
+    """
+    if re2 is not None:
+        letters = ''.join(c for flag, c in _INLINE_FLAGS if flags & flag)
+        options = re2.Options()
+        options.log_errors = False   # unsupported syntax is expected; we fall back
+        try:
+            return re2.compile(f"(?{letters}){pattern}" if letters else pattern, options)
+        except re2.error:
+            pass
+    return re.compile(pattern, flags)
+
+def _hyperscan_matcher(terms):
+    """One Hyperscan database for every (pattern, flags) term, or None if it rejects any"""
+    hs_flags = []
+    for _, flags in terms:
+        term_flags = (hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_UCP |
+                      hyperscan.HS_FLAG_SINGLEMATCH | hyperscan.HS_FLAG_ALLOWEMPTY)
+        if flags & re.IGNORECASE:
+            term_flags |= hyperscan.HS_FLAG_CASELESS
+        if flags & re.MULTILINE:
+            term_flags |= hyperscan.HS_FLAG_MULTILINE
+        if flags & re.DOTALL:
+            term_flags |= hyperscan.HS_FLAG_DOTALL
+        hs_flags.append(term_flags)
+    hs_db = hyperscan.Database()
+    try:
+        hs_db.compile(expressions=[pattern.encode('utf-8') for pattern, _ in terms],
+                      ids=list(range(len(terms))), flags=hs_flags)
+    except hyperscan.error:
+        return None   # backrefs, lookarounds, … – Python's engine handles those
+
+    def stop(*_):
+        return True   # first hit is enough; aborts the scan
+
+    def search(content):
+        try:
+            hs_db.scan(content.encode('utf-8'), match_event_handler=stop)
+        except hyperscan.ScanTerminated:
+            return True
+        return False
+    return search
+
+def compile_regex_matcher(terms):
+    """
+    Fold the OR'd (pattern, flags) terms into a single Hyperscan scan per row.
+    None → test the compiled patterns one by one (Hyperscan missing, or it
+    can't compile one of them). A plain Python alternation was measured
+    slower than the loop, since it defeats re's literal-prefix shortcuts.
+    """
+    if not terms or hyperscan is None:
+        return None
+    return _hyperscan_matcher(terms)
+
+@lru_cache(maxsize=128)
+def build_automaton(needles):
+    """
+    Aho–Corasick automaton over a frozenset of lowercased needles, cached
+    so repeated searches skip the build. Built automatons are only read.
+    """
+    automaton = ahocorasick.Automaton()
+    for needle in needles:
+        automaton.add_word(needle, needle)
+    automaton.make_automaton()
+    return automaton
+
 def parse_search_query(query):
-    """Parse advanced search syntax"""
-    # Extract regex patterns: /pattern/flags
+    """
+    Parse advanced search syntax.
+
+    Regexes come back compiled (invalid ones are dropped) and literal
+    needles lowercased, so matches_search does no per-row setup.
+    """
     regex_patterns = []
-    remaining_query = query
-    
-    regex_matches = re.finditer(r'/([^/]+)/([gimsx]*)', query)
-    for match in regex_matches:
-        pattern = match.group(1)
-        flags = match.group(2)
-        regex_flags = 0
-        if 'i' in flags:
-            regex_flags |= re.IGNORECASE
-        if 'm' in flags:
-            regex_flags |= re.MULTILINE
-        if 's' in flags:
-            regex_flags |= re.DOTALL
-        regex_patterns.append((pattern, regex_flags))
-        remaining_query = remaining_query.replace(match.group(0), '')
-    
-    # Extract quoted phrases: "exact phrase"
+    regex_terms = []
     quoted_phrases = []
-    quote_matches = re.finditer(r'"([^"]+)"', remaining_query)
-    for match in quote_matches:
-        quoted_phrases.append(match.group(1))
-        remaining_query = remaining_query.replace(match.group(0), '')
-    
-    # Extract AND terms: word + word
     and_groups = []
-    and_matches = re.finditer(r'(\w+)\s*\+\s*(\w+)', remaining_query)
-    for match in and_matches:
-        and_groups.append([match.group(1), match.group(2)])
-        remaining_query = remaining_query.replace(match.group(0), '')
+    or_terms = []
+    has_regex = False
     
-    # Remaining words are OR terms
-    or_terms = remaining_query.strip().split()
+    for match in QUERY_TOKEN.finditer(query):
+        kind = match.lastgroup
+        if kind == 'flags':
+            has_regex = True
+            term = (match.group('regex'), _regex_flags(match.group('flags')))
+            try:
+                regex_patterns.append(compile_regex(*term))
+                regex_terms.append(term)
+            except re.error:
+                pass  # Invalid regex, skip
+        elif kind == 'phrase':
+            quoted_phrases.append(match.group('phrase').lower())
+        elif kind == 'and2':
+            # longest (usually rarest) term first so all() fails fast
+            and_groups.append(sorted((match.group('and1').lower(), match.group('and2').lower()),
+                                     key=len, reverse=True))
+        else:
+            or_terms.append(match.group('word').lower())
     
-    return {
+    # Many literal needles → scan each row once with an Aho–Corasick automaton
+    automaton = None
+    needle_count = len(quoted_phrases) + len(or_terms) + sum(len(g) for g in and_groups)
+    if ahocorasick is not None and needle_count >= AHO_MIN_NEEDLES:
+        automaton = build_automaton(frozenset(quoted_phrases + or_terms +
+                                              [t for g in and_groups for t in g]))
+    
+    search_params = {
         'regex': regex_patterns,
+        'regex_any': compile_regex_matcher(regex_terms),
         'phrases': quoted_phrases,
         'and_groups': and_groups,
-        'or_terms': [t for t in or_terms if t]
+        'or_terms': or_terms,
+        'has_literals': bool(quoted_phrases or and_groups or or_terms),
+        'automaton': automaton,
+        'any_needles': frozenset(quoted_phrases + or_terms),
+        # an invalid regex is still a criterion – it just never matches
+        'match_all': not (has_regex or quoted_phrases or and_groups or or_terms)
     }
+    search_params['matcher'] = compile_matcher(search_params)
+    return search_params
+
+def compile_matcher(search_params):
+    """
+    Build the per-row predicate for a parsed query, cheapest checks first.
+    Everything it needs is bound once as closure locals, so the per-row
+    call does no dict lookups or setup.
+    """
+    automaton    = search_params['automaton']
+    any_needles  = search_params['any_needles']
+    and_groups   = search_params['and_groups']
+    has_literals = search_params['has_literals']
+    # OR terms and phrases are both "any one hit matches"
+    any_literals = tuple(search_params['or_terms'] + search_params['phrases'])
+    regex_any    = search_params['regex_any']
+    searches     = tuple(pattern.search for pattern in search_params['regex'])
+    match_all    = search_params['match_all']
+
+    def matches(content):
+        if not content:
+            return False
+
+        if automaton is not None:
+            # one pass finds every needle; then evaluate OR / phrase / AND on the hits
+            hits = {needle for _, needle in automaton.iter(content.lower())}
+            if hits:
+                if not hits.isdisjoint(any_needles):
+                    return True
+                for and_group in and_groups:
+                    if all(term in hits for term in and_group):
+                        return True
+
+        elif has_literals:
+            content_lower = content.lower()
+            for term in any_literals:
+                if term in content_lower:
+                    return True
+            # AND groups (all terms must be present)
+            for and_group in and_groups:
+                if all(term in content_lower for term in and_group):
+                    return True
+
+        # Regex last – by far the most expensive check
+        if regex_any is not None:
+            if regex_any(content):
+                return True
+        else:
+            for search in searches:
+                if search(content):
+                    return True
+
+        # no criteria at all → match everything; criteria exist but none matched
+        return match_all
+    return matches
 
 def matches_search(content, search_params):
     """Check if content matches search parameters"""
-    if not content:
-        return False
-    
-    content_lower = content.lower()
-    
-    # Check regex patterns
-    for pattern, flags in search_params['regex']:
-        try:
-            if re.search(pattern, content, flags):
-                return True
-        except re.error:
-            pass  # Invalid regex, skip
-    
-    # Check quoted phrases
-    for phrase in search_params['phrases']:
-        if phrase.lower() in content_lower:
-            return True
-    
-    # Check AND groups (all terms must be present)
-    for and_group in search_params['and_groups']:
-        if all(term.lower() in content_lower for term in and_group):
-            return True
-    
-    # Check OR terms (any term can match)
-    for term in search_params['or_terms']:
-        if term.lower() in content_lower:
-            return True
-    
-    # If no search criteria, don't match
-    if not (search_params['regex'] or
-            search_params['phrases'] or
-            search_params['and_groups'] or
-            search_params['or_terms']):
-        return True   # no criteria at all → match everything
-    return False      # criteria exist but none matched
+    return search_params['matcher'](content)
+
+def filter_rows(rows, search_params):
+    """Lazily yield (id, ts) for each (id, ts, content) row that matches"""
+    matches = search_params['matcher']
+    for post_id, ts, content in rows:
+        if matches(content):
+            yield post_id, ts
+
+_response_cache = {}   # view name -> (expires_at, serialized JSON body, etag)
+_response_cache_lock = threading.Lock()
+
+def cached_json(ttl, max_age=60):
+    """
+    Cache a view's JSON body in-process for `ttl` seconds.
+    The wrapped function returns plain data; hits skip SQL and serialization.
+    Responses carry an ETag, so revalidating browsers get a bodiless 304.
+    """
+    def decorator(build):
+        @wraps(build)
+        def view():
+            now = time.monotonic()
+            entry = _response_cache.get(build.__name__)
+            if entry is None or entry[0] <= now:
+                body = dumps(build())
+                entry = (now + ttl, body, hashlib.md5(body).hexdigest())
+                with _response_cache_lock:
+                    _response_cache[build.__name__] = entry
+            resp = Response(entry[1], mimetype='application/json')
+            resp.set_etag(entry[2])
+            resp.cache_control.public = True
+            resp.cache_control.max_age = max_age
+            return resp.make_conditional(request)
+        return view
+    return decorator
+
+# The Dockerfile's ARG is the source of truth: it both fetches the files and
+# exports the version, so ?v= always names what's in STATIC_DIR. The default
+# only matters outside the image, where the page loads Choices.js from the CDN
+CHOICES_VERSION = os.environ.get('CHOICES_VERSION', '10.2.0')
+STATIC_DIR = Path(__file__).parent / 'static'   # filled by the Docker build
+STATIC_TYPES = {'.js': 'application/javascript', '.css': 'text/css'}
+
+def load_static_assets():
+    """Read vendored assets once: name -> (mimetype, raw bytes, gzipped bytes)"""
+    assets = {}
+    for name in ('choices.min.js', 'choices.min.css'):
+        path = STATIC_DIR / name
+        if path.is_file():
+            data = path.read_bytes()
+            assets[name] = (STATIC_TYPES[path.suffix], data, gzip.compress(data))
+    return assets
+
+_static_assets = load_static_assets()
+
+@app.route('/static/<name>')
+def static_asset(name):
+    """Vendored assets; URLs carry ?v=<version>, so they never change"""
+    asset = _static_assets.get(name)
+    if asset is None:
+        return Response(status=404)
+    mimetype, data, gzipped = asset
+    if request.accept_encodings['gzip']:
+        resp = Response(gzipped, mimetype=mimetype)
+        resp.headers['Content-Encoding'] = 'gzip'
+    else:
+        resp = Response(data, mimetype=mimetype)
+    resp.headers['Vary'] = 'Accept-Encoding'
+    resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return resp
+
+PAGE_MAX_AGE = 300
 
 @app.route('/')
 def index():
-    """Main search interface"""
-    from flask import Response
-    return Response(search_template, mimetype='text/html')
+    """Main search interface (rendered once at import, see bottom of file)"""
+    if request.accept_encodings['gzip']:
+        resp = Response(_RENDERED_GZIP, mimetype='text/html')
+        resp.headers['Content-Encoding'] = 'gzip'
+        resp.set_etag(_RENDERED_ETAG + '-gz')   # strong ETags differ per encoding
+    else:
+        resp = Response(_RENDERED_HTML, mimetype='text/html')
+        resp.set_etag(_RENDERED_ETAG)
+    resp.headers['Vary'] = 'Accept-Encoding'
+    # short-lived: the page's JS has to track API changes after a redeploy
+    resp.cache_control.public = True
+    resp.cache_control.max_age = PAGE_MAX_AGE
+    return resp.make_conditional(request)
 
 @app.route('/api/gms')
+@cached_json(ttl=3600)
 def get_gms():
     """Get list of all GMs for dropdown"""
     db = get_db()
-    cursor = db.execute("""
-        SELECT DISTINCT 
-            a.author_id,
-            COALESCE(g.gm_name, a.author_name, 'Unknown') as display_name
-        FROM posts p
-        JOIN authors a ON p.author_id = a.author_id
-        LEFT JOIN gm_names g ON a.author_id = g.author_id
-        ORDER BY display_name
+    cursor = db.execute(f"""
+        SELECT d.author_id, d.display_name
+        FROM {author_display_source(db)} d
+        WHERE EXISTS (SELECT 1 FROM posts p WHERE p.author_id = d.author_id)
+        ORDER BY d.display_name
     """)
     
-    gms = [{'id': row['author_id'], 'name': row['display_name']} for row in cursor]
-    return jsonify(gms)
+    return [{'id': row['author_id'], 'name': row['display_name']} for row in cursor]
 
 @app.route('/api/channels')
+@cached_json(ttl=3600)
 def get_channels():
     db = get_db()
     rows = db.execute("""
@@ -149,60 +419,284 @@ def get_channels():
         WHERE c.accessible = 1
         ORDER BY parent_name, c.name
     """)
-    grouped = {}
-    for r in rows:
-        parent = r['parent_name'] or r['name']          # top-level acts as its own group
-        grouped.setdefault(parent, []).append({'id': r['chan_id'], 'name': r['name']})
+    # flat, already in display order; the page groups it in one pass
+    return [{'parent': r['parent_name'] or r['name'],   # top-level acts as its own group
+             'id': r['chan_id'], 'name': r['name']} for r in rows]
 
-    return jsonify(grouped)   # {"#general":[{id,name},…], "#events":[…]}
 
+_tables_present = set()   # probed tables known to exist; they never go away
 
-@app.route('/api/search')
-def search():
-    """Search posts with advanced query support"""
-    # Get parameters
+def has_table(db, name):
+    """
+    True if `name` exists. The bot's ensure_* migrations create the derived
+    tables, so a seed copy or an old backup can lack them; a missing table
+    is re-probed (cheaply) in case the bot has migrated the file since.
+    """
+    if name not in _tables_present:
+        row = db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+        ).fetchone()
+        if row is None:
+            return False
+        _tables_present.add(name)
+    return True
+
+def has_fts(db):
+    """True if the posts_fts full-text index exists in this database"""
+    return has_table(db, 'posts_fts')
+
+# Resolved names the way author_display stores them, for databases without it
+AUTHOR_DISPLAY_FALLBACK = """(
+    SELECT a.author_id, COALESCE(g.gm_name, a.author_name, 'Unknown') AS display_name
+    FROM authors a
+    LEFT JOIN gm_names g ON a.author_id = g.author_id
+)"""
+
+def author_display_source(db):
+    """author_display, or an equivalent subquery if the bot hasn't built it yet"""
+    return 'author_display' if has_table(db, 'author_display') else AUTHOR_DISPLAY_FALLBACK
+
+def _fts_quote(term):
+    return '"' + term.replace('"', '""') + '"'
+
+def build_fts_query(search_params):
+    """
+    Translate parsed search params into an FTS5 MATCH expression.
+
+    Returns None when the query can't be expressed exactly: regex patterns
+    have no FTS equivalent, and the trigram tokenizer can't match needles
+    shorter than three characters. Callers fall back to matches_search.
+    """
+    if search_params['regex']:
+        return None
+
+    needles = (search_params['phrases'] + search_params['or_terms'] +
+               [t for group in search_params['and_groups'] for t in group])
+    if not needles or any(len(t) < 3 for t in needles):
+        return None
+
+    parts = [_fts_quote(p) for p in search_params['phrases']]
+    parts += ['(' + ' AND '.join(_fts_quote(t) for t in group) + ')'
+              for group in search_params['and_groups']]
+    parts += [_fts_quote(t) for t in search_params['or_terms']]
+    return ' OR '.join(parts)
+
+# SQLite's LIKE folds ASCII case only. Python's lower() also maps two
+# non-ASCII letters onto ASCII ones (KELVIN SIGN -> k, dotted capital I ->
+# i + U+0307); needles containing k or i match against this copy instead.
+LIKE_FOLDED = "replace(replace(p.content, char(8490), 'k'), char(304), 'i' || char(775))"
+
+def _like_term(term):
+    column = LIKE_FOLDED if 'k' in term or 'i' in term else 'p.content'
+    pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    return column + " LIKE ? ESCAPE '\\'", pattern
+
+def build_like_filter(search_params):
+    """
+    Translate literal-only queries FTS can't serve (short needles, or no
+    posts_fts) into LIKE predicates, so SQLite drops non-matches in C.
+
+    Returns (sql, params), or None when Python has to decide: regexes, and
+    non-ASCII needles, which LIKE compares case-sensitively.
+    """
+    if search_params['regex']:
+        return None
+    groups = ([(t,) for t in search_params['phrases'] + search_params['or_terms']] +
+              list(search_params['and_groups']))
+    if not groups or not all(t.isascii() for group in groups for t in group):
+        return None
+
+    parts, params = [], []
+    for group in groups:
+        terms = [_like_term(t) for t in group]
+        parts.append('(' + ' AND '.join(sql for sql, _ in terms) + ')')
+        params += [pattern for _, pattern in terms]
+    return " AND (" + ' OR '.join(parts) + ")", params
+
+def dumps(obj):
+    """Serialize to compact JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+def json_response(obj, status=200):
+    """JSON Response via dumps – Flask's dict return would use stdlib json"""
+    return Response(dumps(obj), status=status, mimetype='application/json')
+
+NAME_MAP_TTL = 300   # seconds; authors/gm_names/channels change rarely
+_name_maps = (0.0, {}, {})   # (expires_at, author_id -> name, chan_id -> name)
+_name_maps_lock = threading.Lock()
+
+def get_name_maps(db):
+    """
+    Display names for authors and channels, prefetched into dicts so search
+    rows don't need joins just to turn ids into labels.
+    """
+    global _name_maps
+    expires, authors, channels = _name_maps
+    if expires > time.monotonic():
+        return authors, channels
+    with _name_maps_lock:
+        if _name_maps[0] <= time.monotonic():
+            authors = dict(db.execute(
+                f"SELECT author_id, display_name FROM {author_display_source(db)}").fetchall())
+            channels = {chan_id: name for chan_id, name in
+                        db.execute("SELECT chan_id, name FROM channels") if name}
+            _name_maps = (time.monotonic() + NAME_MAP_TTL, authors, channels)
+        return _name_maps[1], _name_maps[2]
+
+def post_to_dict(row, authors, channels, as_html=False):
+    """Shape a plain-tuple SEARCH_SELECT(_HTML) row for the JSON response"""
+    if as_html:
+        post_id, chan_id, author_id, ts, content, replayed, body = row
+    else:
+        post_id, chan_id, author_id, ts, content, replayed = row
+    post = {
+        'id': str(post_id),                # snowflakes overflow JS numbers
+        'channel_id': chan_id,
+        'channel'   : channels.get(chan_id, chan_id),
+        'author_id': author_id,
+        'author_name': authors.get(author_id, 'Unknown'),
+        'timestamp': ts,                   # ms since epoch – the client formats it
+        'replayed': replayed
+    }
+    if as_html:
+        # cached by the post_html triggers; escape here if the row predates them
+        post['html'] = body if body is not None else html.escape(content or '', quote=False)
+    else:
+        post['content'] = content
+    return post
+
+MAX_PER_PAGE = 200   # the stream is committed to a 200 before any row is read
+
+# Names are filled in from get_name_maps, so posts is read without joins.
+# Read these on a cursor with row_factory=None – post_to_dict unpacks tuples
+SEARCH_SELECT = """
+    SELECT p.id, p.chan_id, p.author_id, p.ts, p.content, p.replayed
+    FROM posts p
+    WHERE 1=1
+"""
+# ?format=html: ship the pre-escaped post_html body instead of raw content
+SEARCH_SELECT_HTML = """
+    SELECT p.id, p.chan_id, p.author_id, p.ts, p.content, p.replayed, h.html
+    FROM posts p
+    LEFT JOIN post_html h ON h.id = p.id
+    WHERE 1=1
+"""
+# Same shape for databases without post_html: post_to_dict escapes the content
+SEARCH_SELECT_HTML_UNCACHED = """
+    SELECT p.id, p.chan_id, p.author_id, p.ts, p.content, p.replayed, NULL
+    FROM posts p
+    WHERE 1=1
+"""
+
+# posts_fts mirrors posts row for row, so with no other filter we count
+# matches without probing posts at all (joining them instead is far slower
+# once other filters are present, hence the IN form in FILTER_SQL)
+FTS_COUNT = "SELECT COUNT(*) FROM posts_fts WHERE posts_fts MATCH ?"
+
+# Python-filtered searches scan only what matching needs
+RESIDUAL_SCAN = """
+    SELECT p.id, p.ts, p.content
+    FROM posts p
+    WHERE 1=1
+"""
+
+SEARCH_COUNT = """
+    SELECT COUNT(*)
+    FROM posts p
+    WHERE 1=1
+"""
+
+# Optional search filters, each binding exactly one parameter
+FILTER_SQL = {
+    'gm':        "AND p.author_id = ?",
+    # one bound JSON array keeps the SQL text fixed for any channel count
+    'channels':  "AND p.chan_id IN (SELECT value FROM json_each(?))",
+    'date_from': "AND p.ts >= ?",
+    'date_to':   "AND p.ts <= ?",
+    'fts':       "AND p.id IN (SELECT rowid FROM posts_fts WHERE posts_fts MATCH ?)",
+}
+# Placeholder values for check_query_plans – only the plan matters
+FILTER_SAMPLES = {'gm': '0', 'channels': '["0"]', 'date_from': 0, 'date_to': 0, 'fts': '"abc"'}
+
+def check_query_plans(db):
+    """
+    EXPLAIN every search filter combination (and the stats queries) and
+    warn about any plan that scans posts without an index – i.e. a missing
+    or dropped index after a migration. Returns the offending SQL.
+    """
+    filters = [f for f in FILTER_SQL if f != 'fts' or has_fts(db)]
+    shapes = []
+    for mask in range(1 << len(filters)):
+        chosen = [f for i, f in enumerate(filters) if mask >> i & 1]
+        where_sql = ' '.join(FILTER_SQL[f] for f in chosen)
+        params = [FILTER_SAMPLES[f] for f in chosen]
+        shapes.append((SEARCH_SELECT + where_sql + " ORDER BY p.ts DESC, p.id DESC LIMIT ?", params + [50]))
+        shapes.append((SEARCH_COUNT + where_sql, params))
+    shapes.append(("SELECT 1 FROM posts p WHERE p.author_id = ? LIMIT 1", ['0']))   # /api/gms
+
+    bad = []
+    for sql, params in shapes:
+        for row in db.execute("EXPLAIN QUERY PLAN " + sql, params):
+            detail = row[3]
+            if re.match(r'SCAN (p|posts)\b', detail) and 'INDEX' not in detail:
+                print(f"[Viewer] WARNING unindexed plan ({detail}): {' '.join(sql.split())}")
+                bad.append(sql)
+                break
+    return bad
+
+def run_plan_check():
+    """check_query_plans on a short-lived connection; never fatal"""
+    try:
+        db = sqlite3.connect(app.config['DB_PATH'])
+        try:
+            check_query_plans(db)
+        finally:
+            db.close()
+    except sqlite3.Error as e:
+        print(f"[Viewer] Query plan check skipped: {e}")
+
+def encode_cursor(ts, post_id):
+    """Opaque keyset token for the row a page ended on"""
+    return base64.urlsafe_b64encode(f"{ts}:{post_id}".encode()).decode()
+
+def decode_cursor(token):
+    """(ts, id) from encode_cursor's token; ValueError if it isn't one"""
+    try:
+        ts, post_id = base64.urlsafe_b64decode(token.encode()).decode().split(':')
+        return int(ts), int(post_id)
+    except (ValueError, UnicodeError) as e:
+        raise ValueError(f"invalid cursor: {token!r}") from e
+
+def search_filters(db):
+    """
+    Translate the request's filter args into WHERE fragments + params.
+    Returns (where, params, residual, fts_match); residual is the parsed
+    query when Python still has to filter rows, None when SQL covers it all.
+    """
     query = request.args.get('q', '').strip()
     gm_id = request.args.get('gm_id', '').strip()
     channel_ids = [c for c in request.args.get('channels', '').split(',') if c]
     date_from = request.args.get('date_from', '')
     date_to = request.args.get('date_to', '')
-    page = int(request.args.get('page', 1))
-    per_page = int(request.args.get('per_page', 50))
-    
-    # Build base query
-    sql_parts = ["""
-        SELECT 
-            p.id,
-            p.chan_id,
-            p.author_id,
-            p.ts,
-            p.content,
-            p.replayed,
-            COALESCE(c.name, p.chan_id)                     AS channel_name,
-            COALESCE(g.gm_name, a.author_name, 'Unknown') as author_name
-        FROM posts p
-        JOIN authors a ON p.author_id = a.author_id
-        LEFT JOIN gm_names g ON a.author_id = g.author_id
-        LEFT JOIN channels c ON p.chan_id   = c.chan_id
-        WHERE 1=1
-    """]
     
+    where = []
     params = []
     
     # Add filters
     if gm_id:
-        sql_parts.append("AND p.author_id = ?")
+        where.append(FILTER_SQL['gm'])
         params.append(gm_id)
     
     if channel_ids:
-        placeholders = ','.join('?' * len(channel_ids))
-        sql_parts.append(f"AND p.chan_id IN ({placeholders})")
-        params.extend(channel_ids)
+        where.append(FILTER_SQL['channels'])
+        params.append(json.dumps(channel_ids))
     
     if date_from:
         try:
             dt = datetime.fromisoformat(date_from)
-            sql_parts.append("AND p.ts >= ?")
+            where.append(FILTER_SQL['date_from'])
             params.append(int(dt.timestamp() * 1000))
         except:
             pass
@@ -210,90 +704,226 @@ def search():
     if date_to:
         try:
             dt = datetime.fromisoformat(date_to)
-            sql_parts.append("AND p.ts <= ?")
+            where.append(FILTER_SQL['date_to'])
             params.append(int(dt.timestamp() * 1000))
         except:
             pass
     
-    # Execute query
+    residual = parse_search_query(query) if query else None
+    fts_match = build_fts_query(residual) if residual and has_fts(db) else None
+    if fts_match:
+        where.append(FILTER_SQL['fts'])
+        params.append(fts_match)
+        residual = None
+    elif residual:
+        like = build_like_filter(residual)
+        if like:
+            where.append(like[0])
+            params.extend(like[1])
+            residual = None
+    return where, params, residual, fts_match
+
+def count_matches(db, where, params, residual, fts_match):
+    """Total number of posts the filters match"""
+    if residual:
+        scan = db.cursor()
+        scan.row_factory = None
+        rows = scan.execute(RESIDUAL_SCAN + ' '.join(where), params)
+        return sum(1 for _ in filter_rows(rows, residual))
+    if fts_match and len(where) == 1:
+        # text is the only filter: the index alone knows the count
+        return db.execute(FTS_COUNT, [fts_match]).fetchone()[0]
+    return db.execute(SEARCH_COUNT + ' '.join(where), params).fetchone()[0]
+
+@app.route('/api/count')
+def count():
+    """Total matches for a search – kept apart so keyset pages skip it"""
     db = get_db()
-    cursor = db.execute(' '.join(sql_parts) + " ORDER BY p.ts DESC", params)
-    
-    # Filter by search query if provided
-    all_results = []
-    search_params = parse_search_query(query) if query else None
-    
-    for row in cursor:
-        if not search_params or matches_search(row['content'], search_params):
-            all_results.append({
-                'id': row['id'],
-                'channel_id': row['chan_id'],
-                'channel'   : row['channel_name'],
-                'author_id': row['author_id'],
-                'author_name': row['author_name'],
-                'timestamp': row['ts'],
-                'datetime' : datetime.utcfromtimestamp(row['ts']/1000).isoformat() + 'Z',
-                'content': row['content'],
-                'replayed': row['replayed'],
-                'jump_url': f"https://discord.com/channels/{SOURCE_GUILD_ID}/{row['chan_id']}/{row['id']}"
-            })
-    
-    # Paginate results
-    total = len(all_results)
-    start = (page - 1) * per_page
-    end = start + per_page
-    
-    return jsonify({
-        'results': all_results[start:end],
-        'total': total,
-        'page': page,
-        'per_page': per_page,
-        'total_pages': (total + per_page - 1) // per_page
-    })
+    return json_response({'total': count_matches(db, *search_filters(db))})
+
+@app.route('/api/search')
+def search():
+    """
+    Search posts with advanced query support.
+
+    With ?cursor=<token> (empty for the first page) pages are keyset-based:
+    each is an index range scan below the last (ts, id) seen, the response
+    carries next_cursor and no total (see /api/count). Without it the old
+    page/per_page mode with totals still works.
+    """
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        per_page = min(max(int(request.args.get('per_page', 50)), 1), MAX_PER_PAGE)
+    except ValueError:
+        return json_response({'error': 'page and per_page must be integers'}, status=400)
+    keyset = 'cursor' in request.args
+    as_html = request.args.get('format') == 'html'
+    after = None
+    if request.args.get('cursor'):
+        try:
+            after = decode_cursor(request.args['cursor'])
+        except ValueError as e:
+            return json_response({'error': str(e)}, status=400)
+
+    db = get_db()
+    where, params, residual, fts_match = search_filters(db)
+    where_sql = ' '.join(where)
+
+    start = 0 if keyset else (page - 1) * per_page
+    page_where, page_params = where_sql, params
+    if after is not None:
+        page_where += " AND (p.ts, p.id) < (?, ?)"
+        page_params = params + list(after)
+    # one extra row tells us whether a next page exists
+    limit = per_page + 1 if keyset else per_page
+
+    if not as_html:
+        select = SEARCH_SELECT
+    elif has_table(db, 'post_html'):
+        select = SEARCH_SELECT_HTML
+    else:
+        select = SEARCH_SELECT_HTML_UNCACHED
+    authors, channels = get_name_maps(db)
+
+    def generate():
+        # Rows are written as they come off the cursor; totals go last
+        yield b'{"results":['
+        sep = b''
+        last = None
+        more = False
+        total = None
+        # the per-row loop skips sqlite3.Row's name lookups
+        cursor = db.cursor()
+        cursor.row_factory = None
+        if not residual:
+            # Everything is expressible in SQL – fetch just the requested page
+            cursor.execute(select + page_where + " ORDER BY p.ts DESC, p.id DESC LIMIT ? OFFSET ?",
+                           page_params + [limit, start])
+            for n, row in enumerate(cursor):
+                if n == per_page:
+                    more = True
+                    break
+                yield sep + dumps(post_to_dict(row, authors, channels, as_html))
+                sep = b','
+                last = (row[3], row[0])
+            if not keyset:
+                total = count_matches(db, where, params, residual, fts_match)
+        else:
+            # Regex / non-ASCII needles: filter a narrow (id, ts, content) scan in
+            # Python, then load full rows for just the page we return
+            rows = cursor.execute(RESIDUAL_SCAN + page_where + " ORDER BY p.ts DESC, p.id DESC", page_params)
+            # matches stream past; only the page's ids are ever held
+            page_ids = []
+            total = 0
+            for post_id, _ in filter_rows(rows, residual):
+                if keyset:
+                    if len(page_ids) == per_page:
+                        more = True
+                        break   # no total needed, so stop once the page (+1) is found
+                    page_ids.append(post_id)
+                elif start <= total < start + per_page:
+                    page_ids.append(post_id)
+                total += 1
+            if page_ids:
+                found = {row[0]: row for row in
+                         cursor.execute(select + " AND p.id IN (SELECT value FROM json_each(?))",
+                                        [json.dumps(page_ids)])}
+                for post_id in page_ids:
+                    row = found[post_id]
+                    yield sep + dumps(post_to_dict(row, authors, channels, as_html))
+                    sep = b','
+                    last = (row[3], row[0])
+
+        # drop the dict's opening brace; its closing brace ends the response
+        if keyset:
+            tail = {
+                'per_page': per_page,
+                'next_cursor': encode_cursor(*last) if more else None
+            }
+        else:
+            tail = {
+                'total': total,
+                'page': page,
+                'per_page': per_page,
+                'total_pages': (total + per_page - 1) // per_page
+            }
+        yield b'],' + dumps(tail)[1:]
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
 
 @app.route('/api/stats')
+@cached_json(ttl=300)
 def get_stats():
     """Get database statistics"""
     db = get_db()
     
     stats = {}
     
-    # Total posts
-    cursor = db.execute("SELECT COUNT(*) as count FROM posts")
-    stats['total_posts'] = cursor.fetchone()['count']
-    
-    # Total GMs
-    cursor = db.execute("SELECT COUNT(DISTINCT author_id) as count FROM posts")
-    stats['total_gms'] = cursor.fetchone()['count']
+    month_ago = int(datetime.now().timestamp() - 30*24*60*60)
+    if not (has_table(db, 'author_post_counts') and has_table(db, 'post_day_counts')):
+        return get_stats_from_posts(db, month_ago)
+
+    # Everything below reads the counters kept by the post_counts triggers
+    # Total posts / GMs
+    row = db.execute("""
+        SELECT COALESCE(SUM(count), 0) as posts, COUNT(*) as gms
+        FROM author_post_counts
+        WHERE count > 0
+    """).fetchone()
+    stats['total_posts'] = row['posts']
+    stats['total_gms'] = row['gms']
     
     # Posts by GM
-    cursor = db.execute("""
+    cursor = db.execute(f"""
         SELECT 
-            COALESCE(g.gm_name, a.author_name, 'Unknown') as name,
-            COUNT(*) as count
+            d.display_name as name,
+            c.count
+        FROM author_post_counts c
+        JOIN {author_display_source(db)} d ON c.author_id = d.author_id
+        WHERE c.count > 0
+        ORDER BY c.count DESC
+        LIMIT 20
+    """)
+    stats['top_gms'] = [{'name': row['name'], 'count': row['count']} for row in cursor]
+    
+    # Recent activity
+    cursor = db.execute("""
+        SELECT day as date, count
+        FROM post_day_counts
+        WHERE day >= DATE(?, 'unixepoch') AND count > 0
+        ORDER BY day DESC
+        LIMIT 30
+    """, (month_ago,))
+    stats['recent_activity'] = [{'date': row['date'], 'count': row['count']} for row in cursor]
+    
+    return stats
+
+def get_stats_from_posts(db, month_ago):
+    """/api/stats aggregated straight from posts, for databases without the counters"""
+    stats = {}
+    stats['total_posts'] = db.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+    stats['total_gms'] = db.execute("SELECT COUNT(DISTINCT author_id) FROM posts").fetchone()[0]
+
+    cursor = db.execute(f"""
+        SELECT d.display_name as name, COUNT(*) as count
         FROM posts p
-        JOIN authors a ON p.author_id = a.author_id
-        LEFT JOIN gm_names g ON a.author_id = g.author_id
+        JOIN {author_display_source(db)} d ON p.author_id = d.author_id
         GROUP BY p.author_id
         ORDER BY count DESC
         LIMIT 20
     """)
     stats['top_gms'] = [{'name': row['name'], 'count': row['count']} for row in cursor]
-    
-    # Recent activity
+
     cursor = db.execute("""
-        SELECT 
-            DATE(ts/1000, 'unixepoch') as date,
-            COUNT(*) as count
+        SELECT DATE(ts/1000, 'unixepoch') as date, COUNT(*) as count
         FROM posts
         WHERE ts > ?
         GROUP BY date
         ORDER BY date DESC
         LIMIT 30
-    """, (int((datetime.now().timestamp() - 30*24*60*60) * 1000),))
+    """, (month_ago * 1000,))
     stats['recent_activity'] = [{'date': row['date'], 'count': row['count']} for row in cursor]
-    
-    return jsonify(stats)
+    return stats
 
 # HTML template
 search_template = '''
@@ -303,8 +933,14 @@ search_template = '''
     <title>BlueTracker Database Viewer</title>
     <meta charset="utf-8">
     <meta name="viewport" content="width=device-width, initial-scale=1">
-    <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/choices.js/public/assets/styles/choices.min.css">
-    <script defer src="https://cdn.jsdelivr.net/npm/choices.js/public/assets/scripts/choices.min.js"></script>
+{% if local_choices %}
+    <link rel="stylesheet" href="/static/choices.min.css?v={{ choices_version }}">
+    <script defer src="/static/choices.min.js?v={{ choices_version }}"></script>
+{% else %}
+    <link rel="preconnect" href="https://cdn.jsdelivr.net" crossorigin>
+    <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/choices.js@{{ choices_version }}/public/assets/styles/choices.min.css">
+    <script defer src="https://cdn.jsdelivr.net/npm/choices.js@{{ choices_version }}/public/assets/scripts/choices.min.js"></script>
+{% endif %}
     <style>
         body {
             font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, sans-serif;
@@ -533,10 +1169,11 @@ search_template = '''
     
     <script>
         // Source guild ID from config
-        const SOURCE_GUILD_ID = '226045346399256576';
+        const SOURCE_GUILD_ID = {{ guild_id|string|tojson }};
         
-        let currentPage = 1;
-        let totalPages = 1;
+        let cursorStack = [''];   // cursor of every page shown so far; '' = first
+        let nextCursor = null;
+        let totalCount = null;
         
         // Load GMs for dropdown
         async function loadGMs() {
@@ -561,20 +1198,23 @@ search_template = '''
 
         async function loadChannels() {
             const res  = await fetch('/api/channels');
-            const data = await res.json();          // {group:[items]}
+            const data = await res.json();          // [{parent,id,name}], sorted by parent
 
             const select = document.getElementById('channelSelect');
-            for (const [group, items] of Object.entries(data)) {
-                const optgroup = document.createElement('optgroup');
-                optgroup.label = group;
-                items.forEach(ch => {
-                    const opt   = document.createElement('option');
-                    opt.value   = ch.id;
-                    opt.text    = ch.name;
-                    optgroup.appendChild(opt);
-                });
-                select.appendChild(optgroup);
-            }
+            const groups = new Map();
+            data.forEach(ch => {
+                let optgroup = groups.get(ch.parent);
+                if (!optgroup) {
+                    optgroup = document.createElement('optgroup');
+                    optgroup.label = ch.parent;
+                    groups.set(ch.parent, optgroup);
+                    select.appendChild(optgroup);
+                }
+                const opt   = document.createElement('option');
+                opt.value   = ch.id;
+                opt.text    = ch.name;
+                optgroup.appendChild(opt);
+            });
 
             channelChoices = new Choices(select, {
                 removeItemButton:true,
@@ -594,8 +1234,7 @@ search_template = '''
                 gm:       document.getElementById('gmFilter').value,
                 channels: selectedChannelIds(),        // already returns "id1,id2"
                 from:     document.getElementById('dateFrom').value,
-                to:       document.getElementById('dateTo').value,
-                page:     currentPage
+                to:       document.getElementById('dateTo').value
            };
         }
 
@@ -612,7 +1251,6 @@ search_template = '''
                     channelChoices.setChoiceByValue(id);
                 });
             }
-            currentPage = parseInt(f.page || 1, 10);
         }
 
         // Load statistics
@@ -640,23 +1278,26 @@ search_template = '''
         }
         
         // Search function
-        async function search(page = 1) {
-            currentPage = page;
+        async function search(cursor = '') {
+            if (cursor === '') {            // new search: back to the first page
+                cursorStack = [''];
+                totalCount = null;
+            }
 
             const f = readFiltersFromUI();
-            f.page = page;
             const url = new URL(window.location);
+            url.searchParams.delete('page');
             Object.entries(f).forEach(([k, v]) =>
                 v ? url.searchParams.set(k, v) : url.searchParams.delete(k)
             );
             history.replaceState(null, '', url);
             localStorage.setItem('btFilters', JSON.stringify(f));
             
+            const filters = readFilterParams();
             const params = new URLSearchParams({
-                q: f.q, gm_id: f.gm, channels: f.channels,
-                date_from: f.from, date_to: f.to,
-                page: f.page, per_page: 50
+                ...filters, cursor, per_page: 50, format: 'html'
             });
+            if (cursor === '') loadCount(filters);
             
             const resultsDiv = document.getElementById('results');
             resultsDiv.innerHTML = '<div class="loading">Searching...</div>';
@@ -665,10 +1306,11 @@ search_template = '''
                 const response = await fetch('/api/search?' + params);
                 const data = await response.json();
                 
-                totalPages = data.total_pages;
+                nextCursor = data.next_cursor;
                 
                 if (data.results.length === 0) {
                     resultsDiv.innerHTML = '<div class="loading">No results found</div>';
+                    updatePagination();
                     return;
                 }
                 
@@ -684,11 +1326,11 @@ search_template = '''
                                 data-chan-id="${post.channel_id}">
                                 #${escapeHtml(post.channel)}
                             </span>
-                            <span class="post-time">${formatDate(post.datetime)}</span>
+                            <span class="post-time">${formatDate(post.timestamp)}</span>
                         </div>
-                        <div class="post-content">${highlightSearch(escapeHtml(post.content || '(no content)'))}</div>
+                        <div class="post-content">${highlightSearch(post.html || '(no content)')}</div>
                         <div class="post-link">
-                            <a href="${post.jump_url}" target="_blank">Jump to message ↗</a>
+                            <a href="https://discord.com/channels/${SOURCE_GUILD_ID}/${post.channel_id}/${post.id}" target="_blank">Jump to message ↗</a>
                             ${post.replayed ? ' • ✓ Replayed' : ' • ⏳ Not replayed'}
                         </div>
                     </div>
@@ -704,35 +1346,53 @@ search_template = '''
         // Update pagination buttons
         function updatePagination() {
             const paginationDiv = document.getElementById('pagination');
+            const page = cursorStack.length;
+            const count = totalCount === null ? '' :
+                `<span>${totalCount.toLocaleString()} results</span>`;
             
-            if (totalPages <= 1) {
-                paginationDiv.innerHTML = '';
+            if (page === 1 && !nextCursor) {
+                paginationDiv.innerHTML = count;
                 return;
             }
             
-            let buttons = [];
-            
-            // Previous button
-            buttons.push(`<button onclick="search(${currentPage - 1})" ${currentPage === 1 ? 'disabled' : ''}>Previous</button>`);
-            
-            // Page numbers
-            for (let i = 1; i <= Math.min(totalPages, 10); i++) {
-                if (i === currentPage) {
-                    buttons.push(`<button class="current">${i}</button>`);
-                } else {
-                    buttons.push(`<button onclick="search(${i})">${i}</button>`);
-                }
-            }
-            
-            if (totalPages > 10) {
-                buttons.push('<span>...</span>');
-                buttons.push(`<button onclick="search(${totalPages})">${totalPages}</button>`);
-            }
-            
-            // Next button
-            buttons.push(`<button onclick="search(${currentPage + 1})" ${currentPage === totalPages ? 'disabled' : ''}>Next</button>`);
-            
-            paginationDiv.innerHTML = buttons.join('');
+            paginationDiv.innerHTML = [
+                `<button onclick="prevPage()" ${page === 1 ? 'disabled' : ''}>Previous</button>`,
+                `<button class="current">${page}</button>`,
+                `<button onclick="nextPage()" ${nextCursor ? '' : 'disabled'}>Next</button>`,
+                count
+            ].join('');
+        }
+        
+        function nextPage() {
+            if (!nextCursor) return;
+            cursorStack.push(nextCursor);
+            search(nextCursor);
+        }
+        
+        function prevPage() {
+            if (cursorStack.length < 2) return;
+            cursorStack.pop();
+            search(cursorStack[cursorStack.length - 1]);
+        }
+        
+        // Totals are a separate request so pages never wait on a full count
+        async function loadCount(filters) {
+            const key = JSON.stringify(filters);
+            try {
+                const response = await fetch('/api/count?' + new URLSearchParams(filters));
+                const data = await response.json();
+                if (key !== JSON.stringify(readFilterParams())) return;   // stale
+                totalCount = data.total;
+                updatePagination();
+            } catch (_) { /* the count is optional */ }
+        }
+        
+        function readFilterParams() {
+            const f = readFiltersFromUI();
+            return {
+                q: f.q, gm_id: f.gm, channels: f.channels,
+                date_from: f.from, date_to: f.to
+            };
         }
         
         // Clear all filters
@@ -754,8 +1414,8 @@ search_template = '''
             return div.innerHTML;
         }
         
-        function formatDate(iso) {
-            return new Date(iso).toLocaleString();
+        function formatDate(ms) {
+            return new Date(ms).toLocaleString();
         }
         
         function highlightSearch(text) {
@@ -794,7 +1454,7 @@ search_template = '''
             applyFiltersToUI(f);
 
             /* 2. run the first search */
-            search(parseInt(f.page || 1, 10));
+            search();
             
             // Enter key in search box
             document.getElementById('searchQuery').addEventListener('keypress', function(e) {
@@ -805,7 +1465,7 @@ search_template = '''
                 const authorSpan = e.target.closest('[data-author-id]');
                 if (authorSpan) {
                     document.getElementById('gmFilter').value = authorSpan.dataset.authorId;
-                    search(1);     // reset to page 1
+                    search();      // back to the first page
                     return;
                 }
                 // Channel name clicked?
@@ -816,7 +1476,7 @@ search_template = '''
                     if (!channelChoices.getValue(true).includes(id)) {
                         channelChoices.setChoiceByValue(id);
                     }
-                    search(1);
+                    search();
                 }
             });
         };
@@ -831,6 +1491,15 @@ try:
 except ImportError:
     SOURCE_GUILD_ID = '226045346399256576'  # Fallback
 
+# The page never changes while we run: render and compress it exactly once
+_RENDERED_HTML = Template(search_template).render(
+    guild_id=SOURCE_GUILD_ID,
+    choices_version=CHOICES_VERSION,
+    local_choices=len(_static_assets) == 2,   # else fall back to the CDN
+).encode('utf-8')
+_RENDERED_GZIP = gzip.compress(_RENDERED_HTML, compresslevel=9)
+_RENDERED_ETAG = hashlib.md5(_RENDERED_HTML).hexdigest()
+
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser(description='BlueTracker Database Viewer')
@@ -844,4 +1513,5 @@ if __name__ == '__main__':
     
     print(f"Starting viewer on http://{args.host}:{args.port}")
     print(f"Database: {app.config['DB_PATH']}")
-    run_simple(args.host, args.port, app, use_reloader=True, use_debugger=True)
+    run_plan_check()
+    run_simple(args.host, args.port, app, use_debugger=True, threaded=True)
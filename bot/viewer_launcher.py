@@ -3,7 +3,12 @@
 
 import threading
 import logging
-from .viewer import app
+from .viewer import app, run_plan_check, POOL_SIZE
+
+try:
+    from waitress import serve
+except ImportError:          # fall back to Werkzeug's threaded dev server
+    serve = None
 
 # Suppress Flask's default logging
 log = logging.getLogger('werkzeug')
@@ -12,8 +17,13 @@ log.setLevel(logging.ERROR)
 def run_viewer(host='0.0.0.0', port=8080):
     """Run the Flask viewer app"""
     print(f"[Viewer] Starting web interface on port {port}")
+    run_plan_check()
     try:
-        app.run(host=host, port=port, debug=False, use_reloader=False)
+        if serve is not None:
+            # one worker thread per pooled SQLite connection
+            serve(app, host=host, port=port, threads=POOL_SIZE)
+        else:
+            app.run(host=host, port=port, debug=False, use_reloader=False, threaded=True)
     except Exception as e:
         print(f"[Viewer] Failed to start: {e}")
 